@@ -15,7 +15,15 @@ def create_app(config_class=Config):
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Please log in to access this page.'
     
-    from app.routes import auth, dashboard, products, operations, warehouses, profile
+    from app.services import cache, writer
+    cache.init_app(app)
+    writer.init_app(app)
+    
+    from app import sqlite_profile
+    with app.app_context():
+        sqlite_profile.init_app(app, db.engine)
+    
+    from app.routes import auth, dashboard, products, operations, warehouses, profile, health, stock, reports
     
     app.register_blueprint(auth.bp)
     app.register_blueprint(dashboard.bp)
@@ -23,8 +31,14 @@ def create_app(config_class=Config):
     app.register_blueprint(operations.bp)
     app.register_blueprint(warehouses.bp)
     app.register_blueprint(profile.bp)
+    app.register_blueprint(health.bp)
+    app.register_blueprint(stock.bp)
+    app.register_blueprint(reports.bp)
     
     with app.app_context():
         db.create_all()
+        
+        from app.migrations import run_migrations
+        run_migrations(db.engine)
     
     return app
@@ -0,0 +1,139 @@
+"""Versioned schema migrations for existing SQLite databases.
+
+`db.create_all()` only creates missing tables, so changes to tables that
+already exist (new indexes, columns, views) are applied here. The applied
+version is tracked in SQLite's `PRAGMA user_version`; each step runs once,
+in order, inside its own transaction. A step is SQL text or a callable taking
+the connection. Statements must be idempotent because a fresh database gets
+the same objects from `create_all()` first.
+"""
+from sqlalchemy import text
+from sqlalchemy.schema import CreateTable
+from app.models import StockMovement
+from app.services.search import create_product_fts
+from app.services.timeline import TIMELINE_VIEW
+
+def add_column(table, column, definition):
+    """Step adding a column unless `create_all()` already created it."""
+    def step(conn):
+        columns = {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info({table})')}
+        if column not in columns:
+            conn.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return step
+
+
+def _highest_movement_id(conn):
+    return conn.exec_driver_sql(
+        'SELECT max(coalesce((SELECT max(id) FROM stock_movements), 0), '
+        'coalesce((SELECT max(id) FROM stock_movements_archive), 0), '
+        "coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'stock_movements'), 0))"
+    ).scalar()
+
+
+def autoincrement_stock_movements(conn):
+    """Rebuild stock_movements with AUTOINCREMENT and start its sequence above every archived id.
+
+    Live rows that already reuse an archived id get fresh ids above them.
+    """
+    table = StockMovement.__table__
+    ddl = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'stock_movements'"
+    ).scalar()
+    if 'AUTOINCREMENT' not in ddl.upper():
+        top = conn.exec_driver_sql(
+            'SELECT max(coalesce((SELECT max(id) FROM stock_movements), 0), '
+            'coalesce((SELECT max(id) FROM stock_movements_archive), 0))'
+        ).scalar()
+        new_id = f'CASE WHEN id IN (SELECT id FROM stock_movements_archive) THEN id + {int(top)} ELSE id END'
+        columns = ', '.join(column.name for column in table.c)
+        values = ', '.join(new_id if column.name == 'id' else column.name for column in table.c)
+
+        conn.exec_driver_sql('DROP VIEW IF EXISTS operation_timeline')
+        conn.exec_driver_sql('ALTER TABLE stock_movements RENAME TO stock_movements_old')
+        for index in table.indexes:
+            conn.exec_driver_sql(f'DROP INDEX IF EXISTS {index.name}')
+        conn.execute(CreateTable(table))
+        conn.exec_driver_sql(f'INSERT INTO stock_movements ({columns}) SELECT {values} FROM stock_movements_old')
+        conn.exec_driver_sql('DROP TABLE stock_movements_old')
+        for index in table.indexes:
+            index.create(conn)
+        conn.exec_driver_sql(TIMELINE_VIEW)
+
+    top = _highest_movement_id(conn)
+    conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'stock_movements'")
+    conn.exec_driver_sql(f"INSERT INTO sqlite_sequence (name, seq) VALUES ('stock_movements', {int(top)})")
+
+
+MIGRATIONS = [
+    (1, 'Ledger and document indexes', [
+        'CREATE INDEX IF NOT EXISTS ix_stock_movements_product_warehouse ON stock_movements (product_id, warehouse_id)',
+        'CREATE INDEX IF NOT EXISTS ix_stock_movements_product_created_at ON stock_movements (product_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_stock_movements_created_at ON stock_movements (created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_receipts_status_created_at ON receipts (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_receipts_created_at ON receipts (created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_deliveries_status_created_at ON deliveries (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_deliveries_created_at ON deliveries (created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_transfers_status_created_at ON transfers (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_transfers_created_at ON transfers (created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_adjustments_status_created_at ON adjustments (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_adjustments_created_at ON adjustments (created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_receipt_lines_receipt_id ON receipt_lines (receipt_id)',
+        'CREATE INDEX IF NOT EXISTS ix_delivery_lines_delivery_id ON delivery_lines (delivery_id)',
+        'CREATE INDEX IF NOT EXISTS ix_transfer_lines_transfer_id ON transfer_lines (transfer_id)',
+        'CREATE INDEX IF NOT EXISTS ix_adjustment_lines_adjustment_id ON adjustment_lines (adjustment_id)',
+    ]),
+    (2, 'Product list index', [
+        'CREATE INDEX IF NOT EXISTS ix_products_active_created_at ON products (is_active, created_at)',
+    ]),
+    (3, 'Product full-text search index', [create_product_fts]),
+    # An is_active-led index lured SQLite away from the SKU/barcode indexes
+    # on code lookups; the list only needs created_at.
+    (4, 'Product list index on created_at', [
+        'DROP INDEX IF EXISTS ix_products_active_created_at',
+        'CREATE INDEX IF NOT EXISTS ix_products_created_at ON products (created_at)',
+    ]),
+    (5, 'Stock balance version counter', [
+        add_column('stock_balances', 'version', 'INTEGER NOT NULL DEFAULT 0'),
+    ]),
+    # The timeline is now a view over the ledger; the operations table only
+    # duplicated stock_movements.
+    (6, 'Operation timeline view', [
+        TIMELINE_VIEW,
+        'DROP TABLE IF EXISTS operations',
+    ]),
+    # Fill stock_valuations afterwards with `flask rebuild-valuations`.
+    (7, 'Movement unit cost', [
+        add_column('stock_movements', 'unit_cost', 'FLOAT'),
+        add_column('stock_movements_archive', 'unit_cost', 'FLOAT'),
+    ]),
+    # Without AUTOINCREMENT, SQLite reused archived ids once a checkpoint
+    # emptied the live table.
+    (8, 'Never reuse stock movement ids', [autoincrement_stock_movements]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(engine):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def run_migrations(engine):
+    """Apply pending migrations. Returns the list of (version, description) applied."""
+    current = get_schema_version(engine)
+    applied = []
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        with engine.begin() as conn:
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(text(statement))
+            conn.exec_driver_sql(f'PRAGMA user_version = {int(version)}')
+        applied.append((version, description))
+
+    return applied
@@ -45,6 +45,9 @@ class Warehouse(db.Model):
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -60,45 +63,91 @@ class Product(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     stock_movements = db.relationship('StockMovement', backref='product', lazy='dynamic')
+    stock_balances = db.relationship('StockBalance', backref='product', lazy='dynamic')
     receipt_lines = db.relationship('ReceiptLine', backref='product', lazy='dynamic')
     delivery_lines = db.relationship('DeliveryLine', backref='product', lazy='dynamic')
     transfer_lines = db.relationship('TransferLine', backref='product', lazy='dynamic')
     adjustment_lines = db.relationship('AdjustmentLine', backref='product', lazy='dynamic')
     
     def get_current_stock(self, warehouse_id=None):
-        query = self.stock_movements
+        query = self.stock_balances
         if warehouse_id:
             query = query.filter_by(warehouse_id=warehouse_id)
-        return query.with_entities(func.sum(StockMovement.quantity)).scalar() or 0
-    
-    def get_average_daily_usage(self, days=30):
-        from datetime import timedelta
-        cutoff_date = datetime.utcnow() - timedelta(days=days)
-        
-        total_outgoing = db.session.query(func.sum(StockMovement.quantity)).filter(
-            StockMovement.product_id == self.id,
-            StockMovement.quantity < 0,
-            StockMovement.created_at >= cutoff_date
-        ).scalar() or 0
-        
-        return abs(total_outgoing) / days if days > 0 else 0
+        return query.with_entities(func.sum(StockBalance.quantity)).scalar() or 0
     
     def get_days_left(self, warehouse_id=None):
-        current_stock = self.get_current_stock(warehouse_id)
-        avg_daily_usage = self.get_average_daily_usage()
-        
-        if avg_daily_usage > 0:
-            return current_stock / avg_daily_usage
-        return float('inf')
+        return Product.annotate_stock([self.id], warehouse_id)[self.id]['days_left']
     
     def get_reorder_quantity(self):
         current_stock = self.get_current_stock()
         if current_stock < self.minimum_stock:
             return max(0, self.ideal_stock - current_stock)
         return 0
+    
+    @classmethod
+    def annotate_stock(cls, product_ids, warehouse_id=None):
+        """Bulk equivalent of the per-product stock helpers above.
+        
+        Returns {product_id: {'current_stock', 'avg_daily_usage', 'days_left',
+        'reorder_qty'}} for all requested products; stock comes from one
+        grouped query. Usage and days left come from
+        app.services.forecast.current_usage: the forecast stored by the
+        scheduled `flask forecast-demand`, or the live moving average where that
+        is missing or older than FORECAST_MAX_AGE_HOURS. As with the
+        single-product methods, `current_stock` and `days_left` are scoped to
+        `warehouse_id` when given, while the reorder quantity always uses total
+        stock.
+        """
+        from app.services.stock import stock_totals_query
+        from app.services.forecast import current_usage, days_left
+        
+        product_ids = list(product_ids)
+        if not product_ids:
+            return {}
+        
+        total = stock_totals_query().filter(StockBalance.product_id.in_(product_ids)).subquery()
+        local = total
+        if warehouse_id:
+            local = stock_totals_query(warehouse_id).filter(StockBalance.product_id.in_(product_ids)).subquery()
+        
+        query = db.session.query(
+            cls.id, cls.minimum_stock, cls.ideal_stock,
+            func.coalesce(total.c.stock, 0),
+            func.coalesce(local.c.stock, 0)
+        ).outerjoin(total, total.c.product_id == cls.id)
+        if warehouse_id:
+            query = query.outerjoin(local, local.c.product_id == cls.id)
+        
+        rows = query.filter(cls.id.in_(product_ids)).all()
+        usage = current_usage(product_ids)
+        used_rows = [row for row in rows if row[0] in usage]
+        days = dict(zip(
+            [row[0] for row in used_rows],
+            days_left([row[4] for row in used_rows], [usage[row[0]][1] for row in used_rows],
+                      datetime.utcnow().weekday()).tolist()
+        )) if used_rows else {}
+        
+        annotations = {}
+        for product_id, minimum_stock, ideal_stock, total_stock, current_stock in rows:
+            daily_usage = usage.get(product_id, (0, None))[0]
+            if total_stock < (minimum_stock or 0):
+                reorder_qty = max(0, (ideal_stock or 0) - total_stock)
+            else:
+                reorder_qty = 0
+            annotations[product_id] = {
+                'current_stock': current_stock,
+                'avg_daily_usage': daily_usage,
+                'days_left': days.get(product_id, float('inf')),
+                'reorder_qty': reorder_qty
+            }
+        return annotations
 
 class Receipt(db.Model):
     __tablename__ = 'receipts'
+    __table_args__ = (
+        db.Index('ix_receipts_status_created_at', 'status', 'created_at'),
+        db.Index('ix_receipts_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     reference = db.Column(db.String(100), unique=True, nullable=False)
@@ -118,13 +167,17 @@ class ReceiptLine(db.Model):
     __tablename__ = 'receipt_lines'
     
     id = db.Column(db.Integer, primary_key=True)
-    receipt_id = db.Column(db.Integer, db.ForeignKey('receipts.id'), nullable=False)
+    receipt_id = db.Column(db.Integer, db.ForeignKey('receipts.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Float, nullable=False)
     unit_price = db.Column(db.Float, default=0)
 
 class Delivery(db.Model):
     __tablename__ = 'deliveries'
+    __table_args__ = (
+        db.Index('ix_deliveries_status_created_at', 'status', 'created_at'),
+        db.Index('ix_deliveries_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     reference = db.Column(db.String(100), unique=True, nullable=False)
@@ -144,12 +197,16 @@ class DeliveryLine(db.Model):
     __tablename__ = 'delivery_lines'
     
     id = db.Column(db.Integer, primary_key=True)
-    delivery_id = db.Column(db.Integer, db.ForeignKey('deliveries.id'), nullable=False)
+    delivery_id = db.Column(db.Integer, db.ForeignKey('deliveries.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Float, nullable=False)
 
 class Transfer(db.Model):
     __tablename__ = 'transfers'
+    __table_args__ = (
+        db.Index('ix_transfers_status_created_at', 'status', 'created_at'),
+        db.Index('ix_transfers_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     reference = db.Column(db.String(100), unique=True, nullable=False)
@@ -170,12 +227,16 @@ class TransferLine(db.Model):
     __tablename__ = 'transfer_lines'
     
     id = db.Column(db.Integer, primary_key=True)
-    transfer_id = db.Column(db.Integer, db.ForeignKey('transfers.id'), nullable=False)
+    transfer_id = db.Column(db.Integer, db.ForeignKey('transfers.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Float, nullable=False)
 
 class Adjustment(db.Model):
     __tablename__ = 'adjustments'
+    __table_args__ = (
+        db.Index('ix_adjustments_status_created_at', 'status', 'created_at'),
+        db.Index('ix_adjustments_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     reference = db.Column(db.String(100), unique=True, nullable=False)
@@ -195,7 +256,7 @@ class AdjustmentLine(db.Model):
     __tablename__ = 'adjustment_lines'
     
     id = db.Column(db.Integer, primary_key=True)
-    adjustment_id = db.Column(db.Integer, db.ForeignKey('adjustments.id'), nullable=False)
+    adjustment_id = db.Column(db.Integer, db.ForeignKey('adjustments.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     old_quantity = db.Column(db.Float, nullable=False)
     new_quantity = db.Column(db.Float, nullable=False)
@@ -206,6 +267,14 @@ class AdjustmentLine(db.Model):
 
 class StockMovement(db.Model):
     __tablename__ = 'stock_movements'
+    __table_args__ = (
+        db.Index('ix_stock_movements_product_warehouse', 'product_id', 'warehouse_id'),
+        db.Index('ix_stock_movements_product_created_at', 'product_id', 'created_at'),
+        db.Index('ix_stock_movements_created_at', 'created_at'),
+        # Ids are never reused, even after a checkpoint archives every live
+        # row: archived ids must stay unique and below the live ones.
+        {'sqlite_autoincrement': True},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
@@ -216,19 +285,107 @@ class StockMovement(db.Model):
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    unit_cost = db.Column(db.Float)  # cost per unit the movement was valued at (app.services.valuation)
     
     creator = db.relationship('User', backref='stock_movements')
 
-class Operation(db.Model):
-    __tablename__ = 'operations'
+class ArchivedMovement(db.Model):
+    __tablename__ = 'stock_movements_archive'
+    __table_args__ = (
+        db.Index('ix_stock_movements_archive_product_created_at', 'product_id', 'created_at'),
+        db.Index('ix_stock_movements_archive_created_at', 'created_at'),
+    )
     
+    # Movements older than the latest ledger checkpoint, moved out of
+    # stock_movements with their ids unchanged (app.services.ledger_archive).
     id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), nullable=False)
+    quantity = db.Column(db.Float, nullable=False)
     operation_type = db.Column(db.String(50), nullable=False)
-    reference = db.Column(db.String(100), nullable=False)
-    description = db.Column(db.String(500))
-    quantity = db.Column(db.Float)
-    product_name = db.Column(db.String(200))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    reference = db.Column(db.String(100))
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    unit_cost = db.Column(db.Float)
+    
+    product = db.relationship('Product')
+    warehouse = db.relationship('Warehouse')
+
+class OpeningBalance(db.Model):
+    __tablename__ = 'opening_balances'
+    
+    # Sum of the archived movements per (product, warehouse): stock as of the
+    # latest checkpoint's cutoff. Opening balance + stock_movements = stock.
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), primary_key=True)
+    quantity = db.Column(db.Float, nullable=False, default=0)
+
+class LedgerCheckpoint(db.Model):
+    __tablename__ = 'ledger_checkpoints'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    cutoff = db.Column(db.DateTime, nullable=False)
+    movements_archived = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DailyStock(db.Model):
+    __tablename__ = 'daily_stock'
+    __table_args__ = (
+        db.Index('ix_daily_stock_day', 'day'),
+    )
+    
+    # Per (product, warehouse, day) ledger rollup, written for days with
+    # movements by app.services.snapshots.roll_up_stock. `closing` is the
+    # balance at the end of the day.
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    quantity_in = db.Column(db.Float, nullable=False, default=0)
+    quantity_out = db.Column(db.Float, nullable=False, default=0)
+    closing = db.Column(db.Float, nullable=False)
+
+class ProductForecast(db.Model):
+    __tablename__ = 'product_forecasts'
+    __table_args__ = (
+        db.Index('ix_product_forecasts_computed_at', 'computed_at'),
+    )
+    
+    # Demand forecast per product, replaced as a whole by
+    # app.services.forecast.refresh_forecasts. Products without recent
+    # usage have no row.
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    moving_average = db.Column(db.Float, nullable=False)
+    smoothed_usage = db.Column(db.Float, nullable=False)
+    daily_usage = db.Column(db.Float, nullable=False)
+    weekday_usage = db.Column(db.JSON, nullable=False)  # 7 daily forecasts, Monday first
+    computed_at = db.Column(db.DateTime, nullable=False)
+    
+    product = db.relationship('Product', backref=db.backref('forecast', uselist=False))
+
+class StockValuation(db.Model):
+    __tablename__ = 'stock_valuations'
+    
+    # Weighted-average cost per (product, warehouse), updated with every
+    # movement by app.services.valuation.value_movements. `quantity` follows
+    # stock_balances; the stock's value is quantity * unit_cost. unit_cost is
+    # kept when the stock runs out and is null until the first costed receipt.
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), primary_key=True)
+    quantity = db.Column(db.Float, nullable=False, default=0)
+    unit_cost = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class StockBalance(db.Model):
+    __tablename__ = 'stock_balances'
+    
+    # Running total of stock_movements per (product, warehouse), kept in step
+    # with the ledger by app.services.stock.record_movements. `version` is
+    # bumped on every change and guards withdraw_stock's conditional update.
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), primary_key=True)
+    quantity = db.Column(db.Float, nullable=False, default=0)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    creator = db.relationship('User', backref='operations')
+    warehouse = db.relationship('Warehouse', backref=db.backref('stock_balances', lazy='dynamic'))
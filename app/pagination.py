@@ -0,0 +1,140 @@
+"""Keyset (cursor) pagination for newest-first lists.
+
+Pages are keyed on (created_at, id) instead of OFFSET, so a deep page costs
+the same index range read as the first one and no COUNT(*) is issued. Cursors
+are opaque URL-safe tokens naming the boundary row and the direction to read.
+
+Ranked results (search) have no stable row key, so they page by offset with
+the same opaque tokens.
+"""
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import func, tuple_
+from app import db
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor=None, prev_cursor=None, approx_total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.approx_total = approx_total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def to_dict(self):
+        return {
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+            'approx_total': self.approx_total
+        }
+
+
+def _encode(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def _decode(token):
+    return json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+
+
+def encode_cursor(row, direction):
+    return _encode([row.created_at.isoformat(), row.id, direction])
+
+
+def decode_cursor(token):
+    """Return (created_at, id, direction), or None for a missing or malformed token."""
+    if not token:
+        return None
+    try:
+        created_at, row_id, direction = _decode(token)
+        if direction not in ('next', 'prev'):
+            return None
+        return datetime.fromisoformat(created_at), int(row_id), direction
+    except (ValueError, TypeError):
+        return None
+
+
+def estimate_total(model):
+    """Approximate row count from the rowid span: two index lookups, no table scan.
+
+    Exact while rows are only appended; overestimates by the number of
+    deleted rows otherwise.
+    """
+    low, high = db.session.query(func.min(model.id), func.max(model.id)).one()
+    return high - low + 1 if high is not None else 0
+
+
+def _keyset_rows(query, model, position, limit):
+    """Up to `limit` rows past `position`, in reading order (newest first unless paging back)."""
+    if position is None:
+        return query.order_by(model.created_at.desc(), model.id.desc()).limit(limit).all()
+    created_at, row_id, direction = position
+    key = tuple_(model.created_at, model.id)
+    if direction == 'next':
+        return query.filter(key < tuple_(created_at, row_id)).order_by(
+            model.created_at.desc(), model.id.desc()
+        ).limit(limit).all()
+    return query.filter(key > tuple_(created_at, row_id)).order_by(
+        model.created_at.asc(), model.id.asc()
+    ).limit(limit).all()
+
+
+def keyset_paginate(query, model, cursor=None, per_page=20, with_total=False, older=None):
+    """Return a KeysetPage of `query` ordered newest first by (created_at, id).
+
+    `older` is an optional (query, model) pair whose rows all sort below
+    `query`'s (an archive table); pages continue into it seamlessly.
+    """
+    position = decode_cursor(cursor)
+    sources = [(query, model)] + ([older] if older else [])
+    if position is not None and position[2] == 'prev':
+        sources.reverse()
+
+    rows = []
+    for source_query, source_model in sources:
+        if len(rows) > per_page:
+            break
+        rows += _keyset_rows(source_query, source_model, position, per_page + 1 - len(rows))
+
+    if position is None:
+        items = rows[:per_page]
+        has_next, has_prev = len(rows) > per_page, False
+    elif position[2] == 'next':
+        items = rows[:per_page]
+        has_next, has_prev = len(rows) > per_page, True
+    else:
+        items = list(reversed(rows[:per_page]))
+        has_next, has_prev = True, len(rows) > per_page
+
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(items[-1], 'next') if has_next and items else None,
+        prev_cursor=encode_cursor(items[0], 'prev') if has_prev and items else None,
+        approx_total=sum(estimate_total(source_model) for _, source_model in sources) if with_total else None
+    )
+
+
+def offset_paginate(query, cursor=None, per_page=20):
+    """Return a KeysetPage of an already ordered query, paged by offset."""
+    offset = 0
+    if cursor:
+        try:
+            kind, offset = _decode(cursor)
+            offset = max(int(offset), 0) if kind == 'offset' else 0
+        except (ValueError, TypeError):
+            offset = 0
+
+    rows = query.offset(offset).limit(per_page + 1).all()
+    return KeysetPage(
+        rows[:per_page],
+        next_cursor=_encode(['offset', offset + per_page]) if len(rows) > per_page else None,
+        prev_cursor=_encode(['offset', max(offset - per_page, 0)]) if offset else None
+    )
@@ -1,9 +1,13 @@
-from flask import Blueprint, render_template, request
+from flask import Blueprint, render_template, request, current_app, jsonify
 from flask_login import login_required, current_user
-from app.models import Product, Receipt, Delivery, Transfer, Operation, Warehouse
+from app.models import Product, Receipt, Delivery, Transfer, Warehouse
+from app.services import timeline, forecast
 from app import db
+from app.services.stock import stock_totals_query
+from app.services.cache import kpi_cache
 from sqlalchemy import func, desc
 from datetime import datetime, timedelta
+import math
 
 bp = Blueprint('dashboard', __name__)
 
@@ -11,41 +15,74 @@ bp = Blueprint('dashboard', __name__)
 @bp.route('/dashboard')
 @login_required
 def index():
+    kpis = kpi_cache.get_or_set('dashboard', build_dashboard_kpis)
+    
+    return render_template('dashboard/index.html', 
+                         stats=kpis['stats'], 
+                         recent_operations=kpis['recent_operations'],
+                         low_stock_predictor=kpis['low_stock_predictor'])
+
+@bp.route('/dashboard/cache-stats')
+@login_required
+def cache_stats():
+    return jsonify(kpi_cache.stats())
+
+def build_dashboard_kpis():
     total_products = Product.query.filter_by(is_active=True).count()
     
-    low_stock_items = []
-    for product in Product.query.filter_by(is_active=True).all():
-        current_stock = product.get_current_stock()
-        if current_stock <= product.minimum_stock:
-            low_stock_items.append(product)
+    stock = stock_totals_query().subquery()
+    current_stock = func.coalesce(stock.c.stock, 0)
+    
+    low_stock_count = db.session.query(func.count(Product.id)).outerjoin(
+        stock, stock.c.product_id == Product.id
+    ).filter(
+        Product.is_active == True,
+        current_stock <= Product.minimum_stock
+    ).scalar()
     
     pending_receipts = Receipt.query.filter(Receipt.status.in_(['draft', 'waiting'])).count()
     pending_deliveries = Delivery.query.filter(Delivery.status.in_(['draft', 'waiting'])).count()
     pending_transfers = Transfer.query.filter(Transfer.status.in_(['draft', 'waiting'])).count()
     
-    recent_operations = Operation.query.order_by(desc(Operation.created_at)).limit(10).all()
-    
-    low_stock_predictor = []
-    for product in Product.query.filter_by(is_active=True).all():
-        days_left = product.get_days_left()
-        if days_left < 7 and days_left != float('inf'):
-            low_stock_predictor.append({
-                'product': product,
-                'days_left': round(days_left, 1),
-                'current_stock': product.get_current_stock()
-            })
-    
-    low_stock_predictor.sort(key=lambda x: x['days_left'])
-    
-    stats = {
-        'total_products': total_products,
-        'low_stock_count': len(low_stock_items),
-        'pending_receipts': pending_receipts,
-        'pending_deliveries': pending_deliveries,
-        'pending_transfers': pending_transfers
-    }
+    # Plain dicts rather than ORM instances, so cached entries can be shared
+    # across requests and sessions.
+    recent_operations = timeline.recent_operations(10)
     
-    return render_template('dashboard/index.html', 
-                         stats=stats, 
-                         recent_operations=recent_operations,
-                         low_stock_predictor=low_stock_predictor[:5])
+    # Stock that runs out within `threshold` days is below ceil(threshold / 7)
+    # weeks of forecast usage, so only those rows get the weekday walk.
+    threshold = current_app.config['LOW_STOCK_DAYS_THRESHOLD']
+    usage = forecast.current_usage()
+    candidates = [
+        row for row in db.session.query(
+            Product.id, Product.name, Product.unit_of_measure, current_stock
+        ).outerjoin(
+            stock, stock.c.product_id == Product.id
+        ).filter(Product.is_active == True)
+        if row[0] in usage and row[3] < usage[row[0]][0] * 7 * math.ceil(threshold / 7)
+    ]
+    
+    days = forecast.days_left([row[3] for row in candidates], [usage[row[0]][1] for row in candidates],
+                              datetime.utcnow().weekday()) if candidates else []
+    predictor_rows = sorted(
+        (row[:4] + (product_days_left,) for row, product_days_left in zip(candidates, days)
+         if product_days_left < threshold),
+        key=lambda row: row[4]
+    )[:5]
+    
+    low_stock_predictor = [{
+        'product': {'id': product_id, 'name': name, 'unit_of_measure': unit},
+        'days_left': round(float(product_days_left), 1),
+        'current_stock': product_stock
+    } for product_id, name, unit, product_stock, product_days_left in predictor_rows]
+    
+    return {
+        'stats': {
+            'total_products': total_products,
+            'low_stock_count': low_stock_count,
+            'pending_receipts': pending_receipts,
+            'pending_deliveries': pending_deliveries,
+            'pending_transfers': pending_transfers
+        },
+        'recent_operations': recent_operations,
+        'low_stock_predictor': low_stock_predictor
+    }
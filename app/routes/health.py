@@ -0,0 +1,29 @@
+from flask import Blueprint, jsonify
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from app.migrations import LATEST_VERSION
+from app.sqlite_profile import active_pragmas
+from app.services.writer import write_queue
+from app.services.ledger_archive import latest_checkpoint
+
+bp = Blueprint('health', __name__)
+
+@bp.route('/health')
+def index():
+    try:
+        with db.engine.connect() as conn:
+            schema_version = conn.exec_driver_sql('PRAGMA user_version').scalar()
+            pragmas = active_pragmas(conn)
+        checkpoint = latest_checkpoint()
+    except SQLAlchemyError as e:
+        return jsonify({'status': 'error', 'error': str(e.orig or e)}), 503
+    
+    return jsonify({
+        'status': 'ok',
+        'schema_version': schema_version,
+        'latest_schema_version': LATEST_VERSION,
+        'pragmas': pragmas,
+        'pool': db.engine.pool.status(),
+        'write_queue': write_queue.stats(),
+        'ledger_checkpoint': checkpoint.cutoff.isoformat() if checkpoint else None
+    })
@@ -1,28 +1,205 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import (Blueprint, render_template, redirect, url_for, flash, request, jsonify,
+                   Response, stream_with_context, current_app)
 from flask_login import login_required, current_user
 from app import db
 from app.models import (Receipt, ReceiptLine, Delivery, DeliveryLine, 
                        Transfer, TransferLine, Adjustment, AdjustmentLine,
-                       Product, Warehouse, StockMovement, Operation)
+                       Product, Warehouse, StockMovement, ArchivedMovement)
 from app.forms import ReceiptForm, DeliveryForm, TransferForm, AdjustmentForm
+from app.services.stock import stock_matrix
+from app.services import validation
+from app.services.validation import ValidationError
+from app.services.writer import write_queue, WriteTimeout
+from app.services.cache import invalidate_kpis, invalidate_products
+from app.services.ledger_export import export_ledger, EXPORT_FORMATS, parse_date, parse_end_date
+from app.services.replenishment import plan_replenishment, apply_plan, purchase_csv
+from app.pagination import keyset_paginate
 from datetime import datetime
-from sqlalchemy import desc
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 
 bp = Blueprint('operations', __name__, url_prefix='/operations')
 
+MAX_BULK_LINES = 5000
+MAX_BATCH_DOCUMENTS = 5000
+PER_PAGE = 20
+
+def iso(value):
+    return value.isoformat() if value else None
+
+def document_page_json(page, serialize):
+    return jsonify({'items': [serialize(item) for item in page.items], **page.to_dict()})
+
+def document_json(document):
+    return {
+        'id': document.id,
+        'reference': document.reference,
+        'status': document.status,
+        'notes': document.notes,
+        'created_at': iso(document.created_at),
+        'validated_at': iso(document.validated_at)
+    }
+
+def parse_bulk_lines(quantity_field='quantity', allow_zero=False):
+    """Validate a JSON `lines` array and resolve its products in one query.
+    
+    Each line names its product by `product_id`, `sku` or `barcode`. Returns
+    (items, errors): items carry the resolved `product` plus the numeric
+    fields, errors map line index to a message. Returns (None, message) when
+    the payload itself is unusable.
+    """
+    payload = request.get_json(silent=True) or {}
+    lines = payload.get('lines')
+    if not isinstance(lines, list) or not lines:
+        return None, 'Expected a non-empty "lines" array'
+    if len(lines) > MAX_BULK_LINES:
+        return None, f'At most {MAX_BULK_LINES} lines per request'
+    
+    lookups = [line for line in lines if isinstance(line, dict)]
+    product_ids = {line['product_id'] for line in lookups
+                   if isinstance(line.get('product_id'), int) and not isinstance(line['product_id'], bool)}
+    skus = {line['sku'] for line in lookups if isinstance(line.get('sku'), str)}
+    barcodes = {line['barcode'] for line in lookups if isinstance(line.get('barcode'), str)}
+    
+    by_id, by_sku, by_barcode = {}, {}, {}
+    if product_ids or skus or barcodes:
+        for product in Product.query.filter(
+            Product.is_active == True,
+            or_(Product.id.in_(product_ids), Product.sku.in_(skus), Product.barcode.in_(barcodes))
+        ):
+            by_id[product.id] = product
+            by_sku[product.sku] = product
+            if product.barcode:
+                by_barcode[product.barcode] = product
+    
+    items, errors = [], {}
+    for index, line in enumerate(lines):
+        if not isinstance(line, dict):
+            errors[index] = 'Line must be an object'
+            continue
+        
+        product_id, sku, barcode = line.get('product_id'), line.get('sku'), line.get('barcode')
+        if (product_id is not None and (isinstance(product_id, bool) or not isinstance(product_id, int))
+                or not isinstance(sku, (str, type(None))) or not isinstance(barcode, (str, type(None)))):
+            errors[index] = 'Invalid product reference'
+            continue
+        product = by_id.get(product_id) or by_sku.get(sku) or by_barcode.get(barcode)
+        if product is None:
+            errors[index] = 'Unknown or inactive product'
+            continue
+        
+        quantity = line.get(quantity_field)
+        unit_price = line.get('unit_price', 0)
+        if isinstance(quantity, bool) or not isinstance(quantity, (int, float)):
+            errors[index] = f'"{quantity_field}" must be a number'
+        elif quantity < 0 or (quantity == 0 and not allow_zero):
+            errors[index] = f'"{quantity_field}" must be greater than zero'
+        elif isinstance(unit_price, bool) or not isinstance(unit_price, (int, float)) or unit_price < 0:
+            errors[index] = '"unit_price" must be a non-negative number'
+        else:
+            items.append({'index': index, 'product': product, 'quantity': quantity, 'unit_price': unit_price})
+    
+    return items, errors
+
+def bulk_lines_response(errors, lines):
+    """Per-line results; nothing is saved unless every line is valid."""
+    line_count = len(request.get_json()['lines'])
+    if errors:
+        return jsonify({
+            'success': False,
+            'error': f'{len(errors)} of {line_count} lines rejected; no lines were added',
+            'results': [
+                {'index': index, 'success': False, 'error': errors[index]} if index in errors
+                else {'index': index, 'success': True}
+                for index in range(line_count)
+            ]
+        }), 400
+    
+    db.session.add_all(lines)
+    db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'results': [{'index': index, 'success': True, 'line_id': line.id} for index, line in enumerate(lines)]
+    })
+
+def busy_response(body):
+    """503 for a write the queue withdrew before running it; the client may retry."""
+    return jsonify(body), 503, {'Retry-After': '5'}
+
+def validated_response(label, validate, document_id):
+    """Run a validation through the write queue and report it as JSON."""
+    try:
+        result = write_queue.submit(validate, document_id, current_user.id)
+    except ValidationError as e:
+        if e.details:
+            return jsonify({'error': str(e), 'lines': e.details}), 400
+        return jsonify({'error': str(e)}), 400
+    except WriteTimeout as e:
+        return busy_response({'error': str(e)})
+    
+    invalidate_kpis()
+    invalidate_products(result['product_ids'])
+    
+    flash(f'{label} "{result["reference"]}" validated successfully!', 'success')
+    return jsonify({'success': True})
+
+@bp.route('/<any(receipts, deliveries, transfers, adjustments):kind>/batch-validate', methods=['POST'])
+@login_required
+def batch_validate(kind):
+    """Validate many drafts of one type: by "ids", or every draft created between "start" and "end"."""
+    payload = request.get_json(silent=True) or {}
+    ids = payload.get('ids')
+    
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            return jsonify({'success': False, 'error': '"ids" must be an array of integers'}), 400
+        ids = list(dict.fromkeys(ids))
+    else:
+        try:
+            ids = validation.draft_ids(kind, parse_date(payload.get('start')), parse_end_date(payload.get('end')))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Dates must be YYYY-MM-DD'}), 400
+    
+    if not ids:
+        return jsonify({'success': False, 'error': 'No documents to validate'}), 400
+    if len(ids) > MAX_BATCH_DOCUMENTS:
+        return jsonify({'success': False, 'error': f'At most {MAX_BATCH_DOCUMENTS} documents per request'}), 400
+    
+    report = validation.validate_documents(kind, ids, current_user.id,
+                                           current_app.config['BATCH_VALIDATE_CHUNK_SIZE'], write_queue.submit)
+    invalidate_kpis()
+    invalidate_products(report['product_ids'])
+    
+    validated = sum(1 for result in report['results'] if result['success'])
+    body = {
+        'success': validated == len(ids),
+        'validated': validated,
+        'failed': len(ids) - validated,
+        'results': report['results']
+    }
+    if report['timed_out']:
+        return busy_response(body)
+    return jsonify(body)
+
 @bp.route('/receipts')
 @login_required
 def receipts():
-    page = request.args.get('page', 1, type=int)
     status = request.args.get('status', '')
     
     query = Receipt.query
     if status:
         query = query.filter_by(status=status)
     
-    receipts = query.order_by(desc(Receipt.created_at)).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    receipts = keyset_paginate(query, Receipt, request.args.get('cursor'), PER_PAGE,
+                               with_total=not status)
+    
+    if request.args.get('format') == 'json':
+        return document_page_json(receipts, lambda receipt: {
+            **document_json(receipt),
+            'supplier_name': receipt.supplier_name,
+            'warehouse_id': receipt.warehouse_id
+        })
     
     return render_template('operations/receipts.html', receipts=receipts)
 
@@ -42,6 +219,7 @@ def create_receipt():
         )
         db.session.add(receipt)
         db.session.commit()
+        invalidate_kpis()
         
         flash(f'Receipt "{receipt.reference}" created successfully!', 'success')
         return redirect(url_for('operations.edit_receipt', id=receipt.id))
@@ -79,59 +257,50 @@ def add_receipt_line(id):
     
     return jsonify({'success': True, 'line_id': line.id})
 
-@bp.route('/receipts/<int:id>/validate', methods=['POST'])
+@bp.route('/receipts/<int:id>/add-lines', methods=['POST'])
 @login_required
-def validate_receipt(id):
+def add_receipt_lines(id):
     receipt = Receipt.query.get_or_404(id)
     
     if receipt.status != 'draft':
-        return jsonify({'error': 'Receipt already validated'}), 400
-    
-    if receipt.lines.count() == 0:
-        return jsonify({'error': 'Cannot validate receipt with no lines'}), 400
-    
-    for line in receipt.lines:
-        movement = StockMovement(
-            product_id=line.product_id,
-            warehouse_id=receipt.warehouse_id,
-            quantity=line.quantity,
-            operation_type='receipt',
-            reference=receipt.reference,
-            notes=f'Receipt from {receipt.supplier_name}',
-            created_by=current_user.id
-        )
-        db.session.add(movement)
-        
-        operation = Operation(
-            operation_type='receipt',
-            reference=receipt.reference,
-            description=f'Receipt from {receipt.supplier_name}',
-            quantity=line.quantity,
-            product_name=line.product.name,
-            created_by=current_user.id
-        )
-        db.session.add(operation)
+        return jsonify({'error': 'Can only edit draft receipts'}), 400
     
-    receipt.status = 'done'
-    receipt.validated_at = datetime.utcnow()
-    db.session.commit()
+    items, errors = parse_bulk_lines()
+    if items is None:
+        return jsonify({'error': errors}), 400
     
-    flash(f'Receipt "{receipt.reference}" validated successfully!', 'success')
-    return jsonify({'success': True})
+    lines = [ReceiptLine(
+        receipt_id=receipt.id,
+        product_id=item['product'].id,
+        quantity=item['quantity'],
+        unit_price=item['unit_price']
+    ) for item in items]
+    
+    return bulk_lines_response(errors, lines)
+
+@bp.route('/receipts/<int:id>/validate', methods=['POST'])
+@login_required
+def validate_receipt(id):
+    return validated_response('Receipt', validation.validate_receipt, id)
 
 @bp.route('/deliveries')
 @login_required
 def deliveries():
-    page = request.args.get('page', 1, type=int)
     status = request.args.get('status', '')
     
     query = Delivery.query
     if status:
         query = query.filter_by(status=status)
     
-    deliveries = query.order_by(desc(Delivery.created_at)).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    deliveries = keyset_paginate(query, Delivery, request.args.get('cursor'), PER_PAGE,
+                                 with_total=not status)
+    
+    if request.args.get('format') == 'json':
+        return document_page_json(deliveries, lambda delivery: {
+            **document_json(delivery),
+            'customer_name': delivery.customer_name,
+            'warehouse_id': delivery.warehouse_id
+        })
     
     return render_template('operations/deliveries.html', deliveries=deliveries)
 
@@ -151,6 +320,7 @@ def create_delivery():
         )
         db.session.add(delivery)
         db.session.commit()
+        invalidate_kpis()
         
         flash(f'Delivery "{delivery.reference}" created successfully!', 'success')
         return redirect(url_for('operations.edit_delivery', id=delivery.id))
@@ -192,59 +362,52 @@ def add_delivery_line(id):
     
     return jsonify({'success': True, 'line_id': line.id})
 
-@bp.route('/deliveries/<int:id>/validate', methods=['POST'])
+@bp.route('/deliveries/<int:id>/add-lines', methods=['POST'])
 @login_required
-def validate_delivery(id):
+def add_delivery_lines(id):
     delivery = Delivery.query.get_or_404(id)
     
     if delivery.status != 'draft':
-        return jsonify({'error': 'Delivery already validated'}), 400
-    
-    if delivery.lines.count() == 0:
-        return jsonify({'error': 'Cannot validate delivery with no lines'}), 400
-    
-    for line in delivery.lines:
-        product = Product.query.get(line.product_id)
-        current_stock = product.get_current_stock(delivery.warehouse_id)
-        if current_stock < line.quantity:
-            return jsonify({'error': f'Insufficient stock for {product.name}. Available: {current_stock}'}), 400
-    
-    for line in delivery.lines:
-        movement = StockMovement(
-            product_id=line.product_id,
-            warehouse_id=delivery.warehouse_id,
-            quantity=-line.quantity,
-            operation_type='delivery',
-            reference=delivery.reference,
-            notes=f'Delivery to {delivery.customer_name}',
-            created_by=current_user.id
-        )
-        db.session.add(movement)
-        
-        operation = Operation(
-            operation_type='delivery',
-            reference=delivery.reference,
-            description=f'Delivery to {delivery.customer_name}',
-            quantity=line.quantity,
-            product_name=line.product.name,
-            created_by=current_user.id
-        )
-        db.session.add(operation)
+        return jsonify({'error': 'Can only edit draft deliveries'}), 400
     
-    delivery.status = 'done'
-    delivery.validated_at = datetime.utcnow()
-    db.session.commit()
+    items, errors = parse_bulk_lines()
+    if items is None:
+        return jsonify({'error': errors}), 400
     
-    flash(f'Delivery "{delivery.reference}" validated successfully!', 'success')
-    return jsonify({'success': True})
+    stock = stock_matrix({item['product'].id for item in items}, [delivery.warehouse_id])
+    requested = {}
+    for item in items:
+        product = item['product']
+        requested[product.id] = requested.get(product.id, 0) + item['quantity']
+        available = stock[product.id].get(delivery.warehouse_id, 0)
+        if requested[product.id] > available:
+            errors[item['index']] = f'Insufficient stock for {product.name}. Available: {available}'
+    
+    lines = [DeliveryLine(
+        delivery_id=delivery.id,
+        product_id=item['product'].id,
+        quantity=item['quantity']
+    ) for item in items]
+    
+    return bulk_lines_response(errors, lines)
+
+@bp.route('/deliveries/<int:id>/validate', methods=['POST'])
+@login_required
+def validate_delivery(id):
+    return validated_response('Delivery', validation.validate_delivery, id)
 
 @bp.route('/transfers')
 @login_required
 def transfers():
-    page = request.args.get('page', 1, type=int)
-    transfers = Transfer.query.order_by(desc(Transfer.created_at)).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    transfers = keyset_paginate(Transfer.query, Transfer, request.args.get('cursor'), PER_PAGE,
+                                with_total=True)
+    
+    if request.args.get('format') == 'json':
+        return document_page_json(transfers, lambda transfer: {
+            **document_json(transfer),
+            'source_warehouse_id': transfer.source_warehouse_id,
+            'dest_warehouse_id': transfer.dest_warehouse_id
+        })
     
     return render_template('operations/transfers.html', transfers=transfers)
 
@@ -267,6 +430,7 @@ def create_transfer():
             )
             db.session.add(transfer)
             db.session.commit()
+            invalidate_kpis()
             
             flash(f'Transfer "{transfer.reference}" created successfully!', 'success')
             return redirect(url_for('operations.edit_transfer', id=transfer.id))
@@ -302,70 +466,43 @@ def add_transfer_line(id):
     
     return jsonify({'success': True, 'line_id': line.id})
 
-@bp.route('/transfers/<int:id>/validate', methods=['POST'])
+@bp.route('/transfers/<int:id>/add-lines', methods=['POST'])
 @login_required
-def validate_transfer(id):
+def add_transfer_lines(id):
     transfer = Transfer.query.get_or_404(id)
     
     if transfer.status != 'draft':
-        return jsonify({'error': 'Transfer already validated'}), 400
-    
-    if transfer.lines.count() == 0:
-        return jsonify({'error': 'Cannot validate transfer with no lines'}), 400
-    
-    for line in transfer.lines:
-        product = Product.query.get(line.product_id)
-        current_stock = product.get_current_stock(transfer.source_warehouse_id)
-        if current_stock < line.quantity:
-            return jsonify({'error': f'Insufficient stock for {product.name} in source warehouse. Available: {current_stock}'}), 400
-    
-    for line in transfer.lines:
-        outgoing = StockMovement(
-            product_id=line.product_id,
-            warehouse_id=transfer.source_warehouse_id,
-            quantity=-line.quantity,
-            operation_type='transfer_out',
-            reference=transfer.reference,
-            notes=f'Transfer to {transfer.dest_warehouse.name}',
-            created_by=current_user.id
-        )
-        db.session.add(outgoing)
-        
-        incoming = StockMovement(
-            product_id=line.product_id,
-            warehouse_id=transfer.dest_warehouse_id,
-            quantity=line.quantity,
-            operation_type='transfer_in',
-            reference=transfer.reference,
-            notes=f'Transfer from {transfer.source_warehouse.name}',
-            created_by=current_user.id
-        )
-        db.session.add(incoming)
-        
-        operation = Operation(
-            operation_type='transfer',
-            reference=transfer.reference,
-            description=f'Transfer: {transfer.source_warehouse.name} → {transfer.dest_warehouse.name}',
-            quantity=line.quantity,
-            product_name=line.product.name,
-            created_by=current_user.id
-        )
-        db.session.add(operation)
+        return jsonify({'error': 'Can only edit draft transfers'}), 400
     
-    transfer.status = 'done'
-    transfer.validated_at = datetime.utcnow()
-    db.session.commit()
+    items, errors = parse_bulk_lines()
+    if items is None:
+        return jsonify({'error': errors}), 400
     
-    flash(f'Transfer "{transfer.reference}" validated successfully!', 'success')
-    return jsonify({'success': True})
+    lines = [TransferLine(
+        transfer_id=transfer.id,
+        product_id=item['product'].id,
+        quantity=item['quantity']
+    ) for item in items]
+    
+    return bulk_lines_response(errors, lines)
+
+@bp.route('/transfers/<int:id>/validate', methods=['POST'])
+@login_required
+def validate_transfer(id):
+    return validated_response('Transfer', validation.validate_transfer, id)
 
 @bp.route('/adjustments')
 @login_required
 def adjustments():
-    page = request.args.get('page', 1, type=int)
-    adjustments = Adjustment.query.order_by(desc(Adjustment.created_at)).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    adjustments = keyset_paginate(Adjustment.query, Adjustment, request.args.get('cursor'), PER_PAGE,
+                                  with_total=True)
+    
+    if request.args.get('format') == 'json':
+        return document_page_json(adjustments, lambda adjustment: {
+            **document_json(adjustment),
+            'reason': adjustment.reason,
+            'warehouse_id': adjustment.warehouse_id
+        })
     
     return render_template('operations/adjustments.html', adjustments=adjustments)
 
@@ -385,6 +522,7 @@ def create_adjustment():
         )
         db.session.add(adjustment)
         db.session.commit()
+        invalidate_kpis()
         
         flash(f'Adjustment "{adjustment.reference}" created successfully!', 'success')
         return redirect(url_for('operations.edit_adjustment', id=adjustment.id))
@@ -424,55 +562,101 @@ def add_adjustment_line(id):
     
     return jsonify({'success': True, 'line_id': line.id, 'old_quantity': old_quantity})
 
-@bp.route('/adjustments/<int:id>/validate', methods=['POST'])
+@bp.route('/adjustments/<int:id>/add-lines', methods=['POST'])
 @login_required
-def validate_adjustment(id):
+def add_adjustment_lines(id):
     adjustment = Adjustment.query.get_or_404(id)
     
     if adjustment.status != 'draft':
-        return jsonify({'error': 'Adjustment already validated'}), 400
+        return jsonify({'error': 'Can only edit draft adjustments'}), 400
     
-    if adjustment.lines.count() == 0:
-        return jsonify({'error': 'Cannot validate adjustment with no lines'}), 400
+    items, errors = parse_bulk_lines('new_quantity', allow_zero=True)
+    if items is None:
+        return jsonify({'error': errors}), 400
     
-    for line in adjustment.lines:
-        difference = line.difference
-        
-        if difference != 0:
-            movement = StockMovement(
-                product_id=line.product_id,
-                warehouse_id=adjustment.warehouse_id,
-                quantity=difference,
-                operation_type='adjustment',
-                reference=adjustment.reference,
-                notes=f'Adjustment: {adjustment.reason}',
-                created_by=current_user.id
-            )
-            db.session.add(movement)
-            
-            operation = Operation(
-                operation_type='adjustment',
-                reference=adjustment.reference,
-                description=f'Adjustment: {adjustment.reason}',
-                quantity=abs(difference),
-                product_name=line.product.name,
-                created_by=current_user.id
-            )
-            db.session.add(operation)
-    
-    adjustment.status = 'done'
-    adjustment.validated_at = datetime.utcnow()
-    db.session.commit()
+    stock = stock_matrix({item['product'].id for item in items}, [adjustment.warehouse_id])
+    lines = [AdjustmentLine(
+        adjustment_id=adjustment.id,
+        product_id=item['product'].id,
+        old_quantity=stock[item['product'].id].get(adjustment.warehouse_id, 0),
+        new_quantity=item['quantity']
+    ) for item in items]
     
-    flash(f'Adjustment "{adjustment.reference}" validated successfully!', 'success')
-    return jsonify({'success': True})
+    return bulk_lines_response(errors, lines)
+
+@bp.route('/adjustments/<int:id>/validate', methods=['POST'])
+@login_required
+def validate_adjustment(id):
+    return validated_response('Adjustment', validation.validate_adjustment, id)
 
 @bp.route('/history')
 @login_required
 def history():
-    page = request.args.get('page', 1, type=int)
-    movements = StockMovement.query.order_by(desc(StockMovement.created_at)).paginate(
-        page=page, per_page=50, error_out=False
+    movements = keyset_paginate(
+        StockMovement.query.options(joinedload(StockMovement.product)), StockMovement,
+        request.args.get('cursor'), 50, with_total=True,
+        older=(ArchivedMovement.query.options(joinedload(ArchivedMovement.product)), ArchivedMovement)
     )
     
+    if request.args.get('format') == 'json':
+        return document_page_json(movements, lambda movement: {
+            'id': movement.id,
+            'created_at': iso(movement.created_at),
+            'operation_type': movement.operation_type,
+            'reference': movement.reference,
+            'product_id': movement.product_id,
+            'product_name': movement.product.name,
+            'warehouse_id': movement.warehouse_id,
+            'quantity': movement.quantity,
+            'notes': movement.notes
+        })
+    
     return render_template('operations/history.html', movements=movements)
+
+@bp.route('/history/export')
+@login_required
+def export_history():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format. Use one of: {", ".join(EXPORT_FORMATS)}'}), 400
+    
+    try:
+        chunks, mimetype = export_ledger(
+            fmt,
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            warehouse_id=request.args.get('warehouse_id', type=int),
+            product_id=request.args.get('product_id', type=int),
+            operation_type=request.args.get('operation_type')
+        )
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
+    
+    filename = f'stock-ledger-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}'
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@bp.route('/replenishment')
+@login_required
+def replenishment():
+    """Preview the replenishment plan; `?format=csv` downloads its purchase list."""
+    plan = plan_replenishment(request.args.get('receiving_warehouse_id', type=int))
+    
+    if request.args.get('format') == 'csv':
+        filename = f'purchases-{datetime.utcnow():%Y%m%d-%H%M%S}.csv'
+        return Response(purchase_csv(plan['purchases']), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+    
+    return jsonify(plan)
+
+@bp.route('/replenishment/apply', methods=['POST'])
+@login_required
+def apply_replenishment():
+    """Create the plan's draft transfers; the purchase list is returned for ordering."""
+    try:
+        result = write_queue.submit(apply_plan, (request.json or {}).get('receiving_warehouse_id'), current_user.id)
+    except WriteTimeout as e:
+        return busy_response({'error': str(e)})
+    invalidate_kpis()
+    
+    return jsonify(result)
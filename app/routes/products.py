@@ -1,16 +1,29 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import (Blueprint, render_template, redirect, url_for, flash, request, jsonify,
+                   current_app, send_from_directory)
 from flask_login import login_required, current_user
 from app import db
-from app.models import Product, Category, Warehouse, StockMovement
+from app.models import Product, Category, Warehouse
 from app.forms import ProductForm, CategoryForm
-from sqlalchemy import desc
+from app.services.cache import (invalidate_kpis, invalidate_products, invalidate_all_products, barcode_cache,
+                                barcode_generation, cache_barcode)
+from app.services.stock import stock_matrix
+from app.services.catalog_import import import_catalog, detect_format
+from app.services.search import search_products
+from app.services import ledger_archive
+from app.services.forecast import forecast_cutoff
+from app.pagination import keyset_paginate, offset_paginate
+from datetime import datetime
+import os
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 
 bp = Blueprint('products', __name__, url_prefix='/products')
 
+MAX_RESOLVE_CODES = 1000
+
 @bp.route('/')
 @login_required
 def index():
-    page = request.args.get('page', 1, type=int)
     category_id = request.args.get('category', type=int)
     search = request.args.get('search', '')
     
@@ -19,31 +32,45 @@ def index():
     if category_id:
         query = query.filter_by(category_id=category_id)
     
+    query = query.options(joinedload(Product.category))
     if search:
-        query = query.filter(
-            (Product.name.ilike(f'%{search}%')) | 
-            (Product.sku.ilike(f'%{search}%')) |
-            (Product.barcode.ilike(f'%{search}%'))
-        )
-    
-    products = query.order_by(desc(Product.created_at)).paginate(
-        page=page, per_page=20, error_out=False
-    )
+        products = offset_paginate(search_products(query, search), request.args.get('cursor'), 20)
+    else:
+        products = keyset_paginate(query, Product, request.args.get('cursor'), 20,
+                                   with_total=not category_id)
     
     categories = Category.query.all()
     
+    annotations = Product.annotate_stock(product.id for product in products.items)
+    
     product_data = []
     for product in products.items:
-        current_stock = product.get_current_stock()
-        days_left = product.get_days_left()
-        reorder_qty = product.get_reorder_quantity()
+        stock_info = annotations[product.id]
+        current_stock = stock_info['current_stock']
+        days_left = stock_info['days_left']
         
         product_data.append({
             'product': product,
             'current_stock': current_stock,
             'days_left': days_left if days_left != float('inf') else None,
             'needs_reorder': current_stock < product.minimum_stock,
-            'reorder_qty': reorder_qty
+            'reorder_qty': stock_info['reorder_qty']
+        })
+    
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'items': [{
+                'id': item['product'].id,
+                'name': item['product'].name,
+                'sku': item['product'].sku,
+                'barcode': item['product'].barcode,
+                'category': item['product'].category.name if item['product'].category else None,
+                'unit': item['product'].unit_of_measure,
+                'current_stock': item['current_stock'],
+                'days_left': item['days_left'],
+                'reorder_qty': item['reorder_qty']
+            } for item in product_data],
+            **products.to_dict()
         })
     
     return render_template('products/index.html', 
@@ -70,33 +97,74 @@ def create():
         
         db.session.add(product)
         db.session.commit()
+        invalidate_kpis()
         
         flash(f'Product "{product.name}" created successfully!', 'success')
         return redirect(url_for('products.detail', id=product.id))
     
     return render_template('products/create.html', form=form)
 
+@bp.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_products():
+    warehouses = Warehouse.query.filter_by(is_active=True).all()
+    
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Please choose a CSV or JSONL file to import.', 'error')
+            return redirect(url_for('products.import_products'))
+        
+        report_dir = import_report_dir(current_user.id)
+        os.makedirs(report_dir, exist_ok=True)
+        report_name = f'{datetime.utcnow():%Y%m%d%H%M%S}-errors.csv'
+        
+        with open(os.path.join(report_dir, report_name), 'w', newline='') as error_stream:
+            stats = import_catalog(
+                upload.stream, detect_format(upload.filename), error_stream=error_stream,
+                warehouse_id=request.form.get('warehouse_id', type=int),
+                user_id=current_user.id
+            )
+        invalidate_kpis()
+        invalidate_all_products()
+        
+        return render_template('products/import.html', warehouses=warehouses, stats=stats,
+                               report_name=report_name if stats['errors'] else None)
+    
+    return render_template('products/import.html', warehouses=warehouses, stats=None)
+
+def import_report_dir(user_id):
+    """Error reports are kept per user; each user can only download their own."""
+    return os.path.join(current_app.instance_path, 'imports', str(user_id))
+
+@bp.route('/import/errors/<path:filename>')
+@login_required
+def import_errors(filename):
+    return send_from_directory(import_report_dir(current_user.id), filename, as_attachment=True)
+
 @bp.route('/<int:id>')
 @login_required
 def detail(id):
     product = Product.query.get_or_404(id)
     
-    current_stock = product.get_current_stock()
-    days_left = product.get_days_left()
-    avg_usage = product.get_average_daily_usage()
-    reorder_qty = product.get_reorder_quantity()
+    stock_info = Product.annotate_stock([product.id])[product.id]
+    current_stock = stock_info['current_stock']
+    days_left = stock_info['days_left']
+    avg_usage = stock_info['avg_daily_usage']
+    reorder_qty = stock_info['reorder_qty']
     
-    recent_movements = StockMovement.query.filter_by(product_id=id).order_by(
-        desc(StockMovement.created_at)
-    ).limit(20).all()
+    recent_movements = ledger_archive.recent_movements(id, 20)
+    forecast = product.forecast
+    if forecast and forecast.computed_at < forecast_cutoff():
+        forecast = None
     
     warehouses = Warehouse.query.filter_by(is_active=True).all()
+    stock_by_warehouse = stock_matrix([product.id])[product.id]
     warehouse_stock = []
     for warehouse in warehouses:
-        stock = product.get_current_stock(warehouse.id)
         warehouse_stock.append({
             'warehouse': warehouse,
-            'stock': stock
+            'stock': stock_by_warehouse.get(warehouse.id, 0)
         })
     
     return render_template('products/detail.html',
@@ -106,6 +174,7 @@ def detail(id):
                          avg_usage=round(avg_usage, 2),
                          reorder_qty=reorder_qty,
                          recent_movements=recent_movements,
+                         forecast=forecast,
                          warehouse_stock=warehouse_stock)
 
 @bp.route('/<int:id>/edit', methods=['GET', 'POST'])
@@ -115,6 +184,8 @@ def edit(id):
     form = ProductForm(obj=product)
     
     if form.validate_on_submit():
+        minimum_stock_changed = product.minimum_stock != form.minimum_stock.data
+        
         product.name = form.name.data
         product.sku = form.sku.data
         product.barcode = form.barcode.data
@@ -125,6 +196,9 @@ def edit(id):
         product.description = form.description.data
         
         db.session.commit()
+        invalidate_products([product.id])
+        if minimum_stock_changed:
+            invalidate_kpis()
         
         flash(f'Product "{product.name}" updated successfully!', 'success')
         return redirect(url_for('products.detail', id=product.id))
@@ -139,22 +213,74 @@ def search_barcode():
     if not barcode:
         return jsonify({'error': 'No barcode provided'}), 400
     
-    product = Product.query.filter_by(barcode=barcode, is_active=True).first()
+    entry = barcode_cache.get(barcode)
+    if entry is None:
+        generation = barcode_generation()
+        product = Product.query.filter_by(barcode=barcode, is_active=True).first()
+        if not product:
+            return jsonify({'success': False, 'error': 'Product not found'}), 404
+        
+        entry = {
+            'id': product.id,
+            'name': product.name,
+            'sku': product.sku,
+            'barcode': product.barcode,
+            'current_stock': Product.annotate_stock([product.id])[product.id]['current_stock'],
+            'unit': product.unit_of_measure
+        }
+        cache_barcode(barcode, entry, generation)
     
-    if product:
-        return jsonify({
-            'success': True,
-            'product': {
-                'id': product.id,
-                'name': product.name,
-                'sku': product.sku,
-                'barcode': product.barcode,
-                'current_stock': product.get_current_stock(),
-                'unit': product.unit_of_measure
-            }
+    return jsonify({'success': True, 'product': entry})
+
+@bp.route('/resolve-codes', methods=['POST'])
+@login_required
+def resolve_codes():
+    """Resolve a scanner session's barcodes and/or SKUs in one round trip.
+    
+    Each code is matched as a barcode first, then as a SKU. Unknown or
+    inactive codes are listed under `unknown`.
+    """
+    payload = request.get_json(silent=True) or {}
+    codes = payload.get('codes')
+    if not isinstance(codes, list) or not codes:
+        return jsonify({'success': False, 'error': 'Expected a non-empty "codes" array'}), 400
+    if len(codes) > MAX_RESOLVE_CODES:
+        return jsonify({'success': False, 'error': f'At most {MAX_RESOLVE_CODES} codes per request'}), 400
+    
+    codes = [str(code).strip() for code in codes if isinstance(code, (str, int)) and not isinstance(code, bool)]
+    codes = list(dict.fromkeys(code for code in codes if code))
+    products = Product.query.filter(
+        Product.is_active == True,
+        or_(Product.barcode.in_(codes), Product.sku.in_(codes))
+    ).all()
+    by_barcode = {product.barcode: product for product in products if product.barcode}
+    by_sku = {product.sku: product for product in products}
+    stock = stock_matrix([product.id for product in products])
+    
+    resolved, unknown = [], []
+    for code in codes:
+        product = by_barcode.get(code) or by_sku.get(code)
+        if product is None:
+            unknown.append(code)
+            continue
+        by_warehouse = stock[product.id]
+        resolved.append({
+            'code': code,
+            'id': product.id,
+            'name': product.name,
+            'sku': product.sku,
+            'barcode': product.barcode,
+            'unit': product.unit_of_measure,
+            'current_stock': sum(by_warehouse.values()),
+            'stock_by_warehouse': {str(warehouse_id): quantity for warehouse_id, quantity in by_warehouse.items()}
         })
-    else:
-        return jsonify({'success': False, 'error': 'Product not found'}), 404
+    
+    return jsonify({'success': True, 'products': resolved, 'unknown': unknown})
+
+@bp.route('/search-barcode/cache-stats')
+@login_required
+def barcode_cache_stats():
+    return jsonify(barcode_cache.stats())
 
 @bp.route('/categories')
 @login_required
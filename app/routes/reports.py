@@ -0,0 +1,52 @@
+from flask import Blueprint, render_template, request, jsonify, Response
+from flask_login import login_required
+from app.models import Warehouse
+from app.services.valuation import value_by_warehouse, value_by_category
+from app.services.analytics import inventory_analytics, analytics_csv
+from datetime import datetime
+
+bp = Blueprint('reports', __name__, url_prefix='/reports')
+
+MAX_REPORT_ROWS = 200
+
+@bp.route('/valuation')
+@login_required
+def valuation():
+    """Stock value at weighted-average cost by warehouse and by category (optionally for one warehouse)."""
+    warehouse_id = request.args.get('warehouse_id', type=int)
+    by_warehouse = value_by_warehouse()
+    by_category = value_by_category(warehouse_id)
+    total_value = sum(row['value'] for row in (by_category if warehouse_id else by_warehouse))
+    
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'warehouse_id': warehouse_id,
+            'total_value': total_value,
+            'warehouses': by_warehouse,
+            'categories': by_category
+        })
+    
+    warehouses = Warehouse.query.order_by(Warehouse.name).all()
+    return render_template('reports/valuation.html', by_warehouse=by_warehouse, by_category=by_category,
+                           total_value=total_value, warehouses=warehouses, warehouse_id=warehouse_id)
+
+@bp.route('/analytics')
+@login_required
+def analytics():
+    """ABC class, turnover and days of cover per product; `abc=A|B|C` and `dead=1` filter, `format=csv|json`."""
+    report = inventory_analytics()
+    abc_class = request.args.get('abc', '').upper()
+    dead_only = request.args.get('dead') == '1'
+    rows = [row for row in report['rows']
+            if (not abc_class or row['abc_class'] == abc_class) and (not dead_only or row['dead_stock'])]
+    
+    fmt = request.args.get('format')
+    if fmt == 'csv':
+        filename = f'inventory-analytics-{datetime.utcnow():%Y%m%d-%H%M%S}.csv'
+        return Response(analytics_csv(rows), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+    if fmt == 'json':
+        return jsonify({**report, 'rows': rows})
+    
+    return render_template('reports/analytics.html', report=report, rows=rows[:MAX_REPORT_ROWS],
+                           total_rows=len(rows), abc_class=abc_class, dead_only=dead_only)
@@ -0,0 +1,69 @@
+from flask import Blueprint, request, jsonify
+from flask_login import login_required
+from app import db
+from app.models import Product, Warehouse
+from app.services.ledger_export import parse_date, parse_end_date
+from app.services.snapshots import stock_as_of, daily_series
+from datetime import datetime, timedelta
+
+bp = Blueprint('stock', __name__, url_prefix='/stock')
+
+MAX_SERIES_DAYS = 366
+
+@bp.route('/as-of')
+@login_required
+def as_of():
+    """Stock per product and warehouse at the end of `date` (YYYY-MM-DD) or at the moment `at` (ISO 8601)."""
+    product_id = request.args.get('product_id', type=int)
+    warehouse_id = request.args.get('warehouse_id', type=int)
+    try:
+        if request.args.get('at'):
+            at = datetime.fromisoformat(request.args['at'])
+        else:
+            at = parse_end_date(request.args.get('date')) or datetime.utcnow()
+    except ValueError:
+        return jsonify({'error': 'Use date=YYYY-MM-DD or an ISO 8601 at= timestamp'}), 400
+
+    stock = stock_as_of(at, product_id, warehouse_id)
+
+    products = db.session.query(Product.id, Product.sku, Product.name)
+    if product_id:
+        products = products.filter(Product.id == product_id)
+    products = {id: (sku, name) for id, sku, name in products}
+    warehouses = dict(db.session.query(Warehouse.id, Warehouse.name))
+
+    items = [{
+        'product_id': key_product_id,
+        'product_sku': products[key_product_id][0],
+        'product_name': products[key_product_id][1],
+        'warehouse_id': key_warehouse_id,
+        'warehouse_name': warehouses.get(key_warehouse_id),
+        'quantity': quantity
+    } for (key_product_id, key_warehouse_id), quantity in sorted(stock.items())]
+
+    return jsonify({
+        'as_of': at.isoformat(),
+        'items': items,
+        'total_quantity': sum(stock.values())
+    })
+
+@bp.route('/daily')
+@login_required
+def daily():
+    """Daily in/out totals and closing stock from `start` to `end` (YYYY-MM-DD, default: the last 30 days)."""
+    try:
+        end = (parse_date(request.args.get('end')) or datetime.utcnow()).date()
+        start = parse_date(request.args.get('start'))
+        start = start.date() if start else end - timedelta(days=29)
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
+    if start > end or (end - start).days >= MAX_SERIES_DAYS:
+        return jsonify({'error': f'start must be on or before end, at most {MAX_SERIES_DAYS} days apart'}), 400
+
+    product_id = request.args.get('product_id', type=int)
+    warehouse_id = request.args.get('warehouse_id', type=int)
+    return jsonify({
+        'product_id': product_id,
+        'warehouse_id': warehouse_id,
+        'days': daily_series(start, end, product_id, warehouse_id)
+    })
@@ -1,8 +1,9 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required
 from app import db
-from app.models import Warehouse
+from app.models import Warehouse, Product, Category
 from app.forms import WarehouseForm
+from app.services.stock import stock_matrix as build_stock_matrix, warehouse_totals
 
 bp = Blueprint('warehouses', __name__, url_prefix='/warehouses')
 
@@ -10,7 +11,61 @@ bp = Blueprint('warehouses', __name__, url_prefix='/warehouses')
 @login_required
 def index():
     warehouses = Warehouse.query.all()
-    return render_template('warehouses/index.html', warehouses=warehouses)
+    totals = warehouse_totals()
+    return render_template('warehouses/index.html', warehouses=warehouses, totals=totals)
+
+def stock_matrix_page():
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', current_app.config['ITEMS_PER_PAGE'], type=int), 200)
+    category_id = request.args.get('category', type=int)
+    
+    query = Product.query.filter_by(is_active=True)
+    if category_id:
+        query = query.filter_by(category_id=category_id)
+    
+    products = query.order_by(Product.name, Product.id).paginate(
+        page=page, per_page=per_page, error_out=False
+    )
+    warehouses = Warehouse.query.filter_by(is_active=True).order_by(Warehouse.name).all()
+    matrix = build_stock_matrix(
+        [product.id for product in products.items],
+        [warehouse.id for warehouse in warehouses]
+    )
+    
+    return products, warehouses, matrix
+
+@bp.route('/overview')
+@login_required
+def overview():
+    products, warehouses, matrix = stock_matrix_page()
+    categories = Category.query.all()
+    
+    return render_template('warehouses/overview.html',
+                         products=products,
+                         warehouses=warehouses,
+                         matrix=matrix,
+                         categories=categories)
+
+@bp.route('/stock-matrix')
+@login_required
+def stock_matrix():
+    products, warehouses, matrix = stock_matrix_page()
+    
+    return jsonify({
+        'page': products.page,
+        'per_page': products.per_page,
+        'total': products.total,
+        'has_next': products.has_next,
+        'warehouses': [{'id': w.id, 'name': w.name} for w in warehouses],
+        'products': [{
+            'id': product.id,
+            'name': product.name,
+            'sku': product.sku,
+            'unit': product.unit_of_measure,
+            'stock': {str(warehouse_id): quantity for warehouse_id, quantity in matrix[product.id].items()},
+            'total': sum(matrix[product.id].values())
+        } for product in products.items]
+    })
 
 @bp.route('/create', methods=['GET', 'POST'])
 @login_required
@@ -0,0 +1,190 @@
+"""ABC classification, turnover and dead stock for the whole catalog.
+
+The movements of the last ANALYTICS_WINDOW_DAYS are read in id ranges of
+ANALYTICS_CHUNK_SIZE as plain driver tuples. Each chunk becomes NumPy
+columns that are summed per product with bincount, so memory stays bounded
+by the chunk, whatever the ledger's size. Per active product:
+
+- usage: units out through deliveries and write-offs (as in forecasts);
+  velocity is usage per day;
+- consumption value: usage at the unit cost each movement recorded, or at
+  the current weighted-average cost where none was recorded;
+- turnover: usage per year over the average of the opening and closing stock
+  of the window;
+- days of cover: current stock over velocity;
+- ABC class: A for the products making up the first ANALYTICS_ABC_SPLIT[0]
+  of consumption value, B up to [1], C for the rest (units when nothing is
+  costed);
+- dead stock: stock on hand without usage in the window.
+
+Reports are cached per ledger high-water mark (the newest movement id), so
+they are recomputed only after stock has moved.
+"""
+import csv
+import io
+from datetime import datetime, timedelta
+import numpy as np
+from flask import current_app
+from sqlalchemy import and_, case, func, select, text
+from app import db
+from app.models import Product, Category, StockMovement, StockValuation
+from app.services.bulk import fetch_tuples
+from app.services.cache import analytics_cache
+from app.services.forecast import DEMAND_TYPES
+from app.services.stock import stock_totals_query
+
+CSV_COLUMNS = ['product_id', 'sku', 'name', 'category', 'abc_class', 'stock', 'usage', 'velocity',
+               'consumption_value', 'turnover', 'days_of_cover', 'dead_stock']
+CHUNK_DTYPE = [('product_id', np.int64), ('quantity', float), ('usage', float),
+               ('costed_value', float), ('uncosted_usage', float)]
+
+
+def high_water_mark():
+    """Id of the newest movement ever recorded (0 for none).
+
+    Movement ids are never reused, so unlike max(id) this cannot go back when
+    a checkpoint archives the live rows.
+    """
+    return db.session.execute(text(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'stock_movements'"
+    )).scalar() or 0
+
+
+def window_start_query(start):
+    """Id of the first movement at or after `start`; ids follow created_at."""
+    return db.session.query(StockMovement.id).filter(StockMovement.created_at >= start).order_by(
+        StockMovement.created_at, StockMovement.id
+    ).limit(1)
+
+
+def movement_chunk_query(start, low, high):
+    """Movements with low <= id < high from `start` on, with their usage and its value split out."""
+    movements = StockMovement.__table__
+    usage = case((and_(movements.c.quantity < 0, movements.c.operation_type.in_(DEMAND_TYPES)),
+                  -movements.c.quantity), else_=0)
+    return select(
+        movements.c.product_id,
+        movements.c.quantity,
+        usage,
+        usage * func.coalesce(movements.c.unit_cost, 0),
+        case((movements.c.unit_cost.is_(None), usage), else_=0)
+    ).where(movements.c.id >= low, movements.c.id < high, movements.c.created_at >= start)
+
+
+def movement_chunks(start, last_id, chunk_size):
+    """Yield the window's movements as structured arrays (CHUNK_DTYPE), one id range at a time."""
+    first_id = window_start_query(start).scalar()
+    if first_id is None:
+        return
+    for low in range(first_id, last_id + 1, chunk_size):
+        rows = fetch_tuples(movement_chunk_query(start, low, low + chunk_size))
+        if rows:
+            yield np.array(rows, dtype=CHUNK_DTYPE)
+
+
+def abc_classes(basis, split=(0.8, 0.95)):
+    """'A'/'B'/'C' per product: A until the products before it cover split[0] of the basis, B until split[1]."""
+    classes = np.full(len(basis), 'C')
+    total = basis.sum()
+    if total <= 0:
+        return classes
+    order = np.argsort(-basis, kind='stable')
+    covered_before = (np.cumsum(basis[order]) - basis[order]) / total
+    ranked = np.where(covered_before < split[0], 'A', np.where(covered_before < split[1], 'B', 'C'))
+    classes[order] = np.where(basis[order] > 0, ranked, 'C')
+    return classes
+
+
+def _optional(values):
+    return [None if not np.isfinite(value) else round(float(value), 4) for value in values]
+
+
+def build_report(window_days, split, chunk_size, last_id):
+    start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=window_days)
+    products = db.session.query(
+        Product.id, Product.sku, Product.name, Category.name
+    ).outerjoin(Category, Category.id == Product.category_id).filter(
+        Product.is_active == True
+    ).order_by(Product.id).all()
+    product_ids = np.array([row[0] for row in products], dtype=np.int64)
+    size = int(max(product_ids.max(initial=0), db.session.query(func.max(Product.id)).scalar() or 0)) + 1
+
+    net, usage, costed_value, uncosted_usage = (np.zeros(size) for _ in range(4))
+    for chunk in movement_chunks(start, last_id, chunk_size):
+        ids = chunk['product_id']
+        net += np.bincount(ids, weights=chunk['quantity'], minlength=size)
+        usage += np.bincount(ids, weights=chunk['usage'], minlength=size)
+        costed_value += np.bincount(ids, weights=chunk['costed_value'], minlength=size)
+        uncosted_usage += np.bincount(ids, weights=chunk['uncosted_usage'], minlength=size)
+
+    stock = np.zeros(size)
+    for product_id, quantity in stock_totals_query():
+        stock[product_id] = quantity or 0
+    # Current cost: weighted over the warehouses holding costed stock, else the plain average.
+    cost = np.zeros(size)
+    costed = and_(StockValuation.quantity > 0, StockValuation.unit_cost.isnot(None))
+    for product_id, value, quantity, unit_cost in db.session.query(
+        StockValuation.product_id,
+        func.sum(case((costed, StockValuation.quantity * StockValuation.unit_cost), else_=0)),
+        func.sum(case((costed, StockValuation.quantity), else_=0)),
+        func.avg(StockValuation.unit_cost)
+    ).group_by(StockValuation.product_id):
+        cost[product_id] = value / quantity if quantity else unit_cost or 0
+
+    stock, usage, net = stock[product_ids], usage[product_ids], net[product_ids]
+    value = costed_value[product_ids] + uncosted_usage[product_ids] * cost[product_ids]
+    velocity = usage / window_days
+    opening_stock = stock - net
+    average_stock = np.maximum((opening_stock + stock) / 2, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        turnover = np.where(average_stock > 0, usage * 365 / window_days / average_stock, np.nan)
+        days_of_cover = np.where(velocity > 0, np.maximum(stock, 0) / velocity, np.inf)
+    classes = abc_classes(value if value.sum() > 0 else usage, split)
+    dead = (stock > 0) & (usage == 0)
+
+    rows = [{
+        'product_id': product_id, 'sku': sku, 'name': name, 'category': category, 'abc_class': abc_class,
+        'stock': product_stock, 'usage': product_usage, 'velocity': product_velocity,
+        'consumption_value': product_value, 'turnover': product_turnover, 'days_of_cover': cover,
+        'dead_stock': is_dead
+    } for (product_id, sku, name, category), abc_class, product_stock, product_usage, product_velocity,
+        product_value, product_turnover, cover, is_dead in zip(
+        products, classes.tolist(), stock.tolist(), usage.tolist(), _optional(velocity),
+        _optional(value), _optional(turnover), _optional(days_of_cover), dead.tolist()
+    )]
+    rows.sort(key=lambda row: (-(row['consumption_value'] or 0), -row['usage'], row['product_id']))
+
+    summary = {abc_class: {
+        'products': int((classes == abc_class).sum()),
+        'consumption_value': round(float(value[classes == abc_class].sum()), 2),
+        'usage': float(usage[classes == abc_class].sum())
+    } for abc_class in 'ABC'}
+    return {
+        'computed_at': datetime.utcnow().isoformat(),
+        'window_start': start.date().isoformat(),
+        'window_days': window_days,
+        'high_water_mark': last_id,
+        'summary': summary,
+        'dead_stock': int(dead.sum()),
+        'rows': rows
+    }
+
+
+def inventory_analytics():
+    """The analytics report for the configured window, cached until the ledger or the day changes."""
+    config = current_app.config
+    window_days = config['ANALYTICS_WINDOW_DAYS']
+    split = tuple(config['ANALYTICS_ABC_SPLIT'])
+    last_id = high_water_mark()
+    key = (last_id, datetime.utcnow().date(), window_days, split)
+    return analytics_cache.get_or_set(
+        key, lambda: build_report(window_days, split, config['ANALYTICS_CHUNK_SIZE'], last_id)
+    )
+
+
+def analytics_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
@@ -0,0 +1,13 @@
+"""Reading large grouped results straight into NumPy."""
+from app import db
+
+
+def fetch_tuples(query):
+    """All rows of `query` (an ORM query or a Core select) as plain driver tuples.
+
+    Grouped reads per product and day or per product and warehouse run into
+    the millions of rows; taking the DB-API cursor's tuples skips building a
+    result row object for each, and np.array takes the list as it is.
+    """
+    statement = getattr(query, 'statement', query)
+    return db.session.connection().execute(statement).cursor.fetchall()
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU cache with a per-entry time-to-live and hit/miss counters.
+
+    Entries are evicted least-recently-used first once `maxsize` is reached,
+    and are treated as missing once they are older than `ttl` seconds
+    (`ttl=None` disables expiry).
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize=None, ttl=None):
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            self.ttl = ttl
+            self._data.clear()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_set(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry else None
+
+    def discard_where(self, predicate):
+        """Drop every entry whose value satisfies `predicate`. Returns the number dropped."""
+        with self._lock:
+            keys = [key for key, (value, _) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+kpi_cache = TTLCache()
+# Scanner lookups: barcode -> {'id', 'name', 'sku', 'barcode', 'current_stock', 'unit'}.
+barcode_cache = TTLCache()
+# Inventory analytics reports, keyed by the ledger high-water mark.
+analytics_cache = TTLCache(maxsize=4)
+
+
+def init_app(app):
+    kpi_cache.configure(
+        maxsize=app.config['KPI_CACHE_MAX_ENTRIES'],
+        ttl=app.config['KPI_CACHE_TTL']
+    )
+    barcode_cache.configure(
+        maxsize=app.config['BARCODE_CACHE_MAX_ENTRIES'],
+        ttl=app.config['BARCODE_CACHE_TTL']
+    )
+
+
+def invalidate_kpis():
+    """Drop cached dashboard figures after operations or stock levels change."""
+    kpi_cache.clear()
+
+
+# Scanner lookups note the generation before reading the database and are
+# cached only if their product was not invalidated since, so a read racing an
+# invalidation cannot put the old values back.
+_generation_lock = threading.Lock()
+_generations = {'current': 0, 'cleared': 0}
+_product_generations = {}
+
+
+def barcode_generation():
+    with _generation_lock:
+        return _generations['current']
+
+
+def cache_barcode(barcode, entry, generation):
+    """Cache a scanner lookup read at `generation` unless its product was invalidated since."""
+    with _generation_lock:
+        invalidated = max(_generations['cleared'], _product_generations.get(entry['id'], 0))
+        if invalidated <= generation:
+            barcode_cache.set(barcode, entry)
+
+
+def invalidate_products(product_ids):
+    """Drop cached scanner lookups for products whose record or stock changed."""
+    product_ids = set(product_ids)
+    if product_ids:
+        with _generation_lock:
+            _generations['current'] += 1
+            _product_generations.update(dict.fromkeys(product_ids, _generations['current']))
+            barcode_cache.discard_where(lambda entry: entry['id'] in product_ids)
+
+
+def invalidate_all_products():
+    """Drop every cached scanner lookup, e.g. after a catalog import."""
+    with _generation_lock:
+        _generations['current'] += 1
+        _generations['cleared'] = _generations['current']
+        _product_generations.clear()
+        barcode_cache.clear()
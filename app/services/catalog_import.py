@@ -0,0 +1,309 @@
+"""Streaming import of products and opening stock from CSV or JSON Lines.
+
+Rows are read one at a time and written in batches: each batch resolves its
+products, categories and current balances with a handful of IN queries, then
+writes products and opening-balance movements with executemany inserts and
+commits. Memory use depends on the batch size, not on the file size.
+
+Recognised columns: sku (required), name (required for new products),
+barcode, category, unit_of_measure, minimum_stock, ideal_stock, description,
+opening_stock and warehouse (name; defaults to the import's warehouse).
+Existing products are matched by SKU, then by barcode; a barcode match keeps
+its SKU.
+`opening_stock` sets the product's quantity in that warehouse: the movement
+written is the difference from the current balance, so re-running an import
+is idempotent.
+"""
+import csv
+import io
+import json
+import time
+from datetime import datetime
+from sqlalchemy import insert, update, bindparam, or_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Product, Category, Warehouse, StockMovement
+from app.services.stock import apply_balance_deltas, stock_matrix
+from app.services.valuation import value_movements
+
+PRODUCT_FIELDS = ('name', 'barcode', 'category_id', 'unit_of_measure',
+                  'minimum_stock', 'ideal_stock', 'description')
+NUMERIC_FIELDS = ('minimum_stock', 'ideal_stock', 'opening_stock')
+ERROR_REPORT_FIELDS = ['row', 'sku', 'error', 'record']
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def detect_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def is_utf8(text):
+    """False for text holding bytes that were not valid UTF-8 (decoded with surrogateescape)."""
+    try:
+        text.encode('utf-8')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def iter_records(stream, fmt):
+    """Yield (row number, dict) from a binary or text stream.
+
+    Rows that are not valid UTF-8 are yielded as ImportRowError, like malformed JSON.
+    """
+    if isinstance(stream, io.TextIOBase):
+        text = stream
+    else:
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='surrogateescape', newline='')
+
+    if fmt == 'jsonl':
+        for row_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            if not is_utf8(line):
+                yield row_number, ImportRowError('Not valid UTF-8')
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield row_number, ImportRowError(f'Invalid JSON: {e}')
+                continue
+            yield row_number, record if isinstance(record, dict) else ImportRowError('Expected a JSON object')
+    else:
+        for row_number, record in enumerate(csv.DictReader(text), start=2):
+            fields = [key for key in record if key is not None] + [
+                value for value in record.values() if isinstance(value, str)
+            ]
+            yield row_number, record if all(map(is_utf8, fields)) else ImportRowError('Not valid UTF-8')
+
+
+def clean_record(record):
+    if isinstance(record, ImportRowError):
+        raise record
+
+    row = {}
+    for key, value in record.items():
+        if key is None:
+            continue
+        if not isinstance(value, (str, int, float, type(None))):
+            raise ImportRowError(f'"{key}" must be a text or number value')
+        if isinstance(value, str):
+            value = value.strip()
+        row[key.strip().lower()] = value if value != '' else None
+
+    if not row.get('sku'):
+        raise ImportRowError('Missing sku')
+    row['sku'] = str(row['sku'])
+    if row.get('barcode') is not None:
+        row['barcode'] = str(row['barcode'])
+
+    for field in NUMERIC_FIELDS:
+        if row.get(field) is not None:
+            try:
+                row[field] = float(row[field])
+            except (TypeError, ValueError):
+                raise ImportRowError(f'"{field}" must be a number')
+            if row[field] < 0:
+                raise ImportRowError(f'"{field}" cannot be negative')
+    return row
+
+
+class CatalogImporter:
+    def __init__(self, warehouse_id=None, user_id=None, batch_size=1000,
+                 progress=None, error_writer=None):
+        self.warehouse_id = warehouse_id
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.progress = progress
+        self.error_writer = error_writer
+        self.stats = {'rows': 0, 'created': 0, 'updated': 0, 'movements': 0,
+                      'categories_created': 0, 'errors': 0}
+        self.categories = {name.lower(): id for id, name in db.session.query(Category.id, Category.name)}
+        self.warehouses = {name.lower(): id for id, name in db.session.query(Warehouse.id, Warehouse.name)}
+        self.started = time.monotonic()
+
+    def run(self, records):
+        batch = []
+        for row_number, record in records:
+            self.stats['rows'] += 1
+            try:
+                batch.append((row_number, clean_record(record)))
+            except ImportRowError as e:
+                self.reject(row_number, record, str(e))
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        if batch:
+            self.flush(batch)
+
+        self.stats['seconds'] = round(time.monotonic() - self.started, 2)
+        return self.stats
+
+    def reject(self, row_number, record, message):
+        self.stats['errors'] += 1
+        if self.error_writer is not None:
+            sku = record.get('sku') if isinstance(record, dict) else None
+            self.error_writer.writerow({
+                'row': row_number,
+                'sku': sku,
+                'error': message,
+                'record': json.dumps(record, default=str) if isinstance(record, dict) else ''
+            })
+
+    def category_id(self, name):
+        key = name.lower()
+        if key not in self.categories:
+            result = db.session.execute(insert(Category.__table__).values(
+                name=name, created_at=datetime.utcnow()
+            ))
+            self.categories[key] = result.inserted_primary_key[0]
+            self.stats['categories_created'] += 1
+        return self.categories[key]
+
+    def flush(self, batch):
+        # Later rows for the same SKU win, as they would in a sequential import.
+        rows = {}
+        for row_number, row in batch:
+            rows[row['sku']] = (row_number, row)
+
+        skus = list(rows)
+        barcodes = [row['barcode'] for _, row in rows.values() if row.get('barcode')]
+        existing = Product.query.with_entities(Product.id, Product.sku, Product.barcode).filter(
+            or_(Product.sku.in_(skus), Product.barcode.in_(barcodes))
+        ).all()
+        by_sku = {sku: id for id, sku, _ in existing}
+        by_barcode = {barcode: id for id, _, barcode in existing if barcode}
+        # Barcode -> owning product id (existing) or SKU (created in this batch).
+        barcode_owner = dict(by_barcode)
+
+        inserts, updates, accepted = [], [], []
+        for sku, (row_number, row) in rows.items():
+            product_id = by_sku.get(sku)
+            if product_id is None:
+                product_id = by_barcode.get(row.get('barcode'))
+
+            barcode = row.get('barcode')
+            if barcode and barcode_owner.get(barcode, product_id) != product_id:
+                self.reject(row_number, row, f'Barcode {barcode} belongs to another product')
+                continue
+            if product_id is None and not row.get('name'):
+                self.reject(row_number, row, 'Missing name for new product')
+                continue
+
+            warehouse_id = self.warehouse_id
+            if row.get('warehouse'):
+                warehouse_id = self.warehouses.get(str(row['warehouse']).lower())
+                if warehouse_id is None:
+                    self.reject(row_number, row, f'Unknown warehouse {row["warehouse"]}')
+                    continue
+            if row.get('opening_stock') is not None and warehouse_id is None:
+                self.reject(row_number, row, 'No warehouse for opening stock')
+                continue
+
+            values = {field: row[field] for field in PRODUCT_FIELDS if row.get(field) is not None}
+            if row.get('category'):
+                values['category_id'] = self.category_id(str(row['category']))
+
+            if barcode:
+                barcode_owner[barcode] = product_id if product_id is not None else sku
+            if product_id is None:
+                values.setdefault('unit_of_measure', 'pcs')
+                values.setdefault('minimum_stock', 0)
+                values.setdefault('ideal_stock', 0)
+                inserts.append(dict(values, sku=sku))
+            elif values:
+                updates.append(dict(values, product_id=product_id))
+            accepted.append((sku, product_id, row, warehouse_id))
+
+        try:
+            self.write_products(inserts, updates)
+            movement_count = self.write_opening_balances(accepted)
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            self.categories = {name.lower(): id for id, name in db.session.query(Category.id, Category.name)}
+            for sku, _, row, _ in accepted:
+                self.reject(rows[sku][0], row, f'Batch rejected by database: {e.orig}')
+        else:
+            self.stats['created'] += len(inserts)
+            self.stats['updated'] += len(updates)
+            self.stats['movements'] += movement_count
+
+        if self.progress:
+            self.progress(self.stats)
+
+    def write_products(self, inserts, updates):
+        now = datetime.utcnow()
+        if inserts:
+            # executemany needs one key set per statement, so group by shape.
+            for keys in {tuple(sorted(row)) for row in inserts}:
+                db.session.execute(insert(Product.__table__), [
+                    dict(row, created_at=now, updated_at=now, is_active=True)
+                    for row in inserts if tuple(sorted(row)) == keys
+                ])
+        if updates:
+            table = Product.__table__
+            for keys in {tuple(sorted(row)) for row in updates}:
+                fields = [key for key in keys if key != 'product_id']
+                stmt = update(table).where(table.c.id == bindparam('product_id')).values(
+                    updated_at=now, **{field: bindparam(field) for field in fields}
+                )
+                db.session.execute(stmt, [row for row in updates if tuple(sorted(row)) == keys])
+
+    def write_opening_balances(self, accepted):
+        """Write movements bringing each row's warehouse stock to `opening_stock`."""
+        openings = [(sku, product_id, row['opening_stock'], warehouse_id)
+                    for sku, product_id, row, warehouse_id in accepted
+                    if row.get('opening_stock') is not None]
+        if not openings:
+            return 0
+
+        new_skus = [sku for sku, product_id, _, _ in openings if product_id is None]
+        created = dict(Product.query.with_entities(Product.sku, Product.id).filter(
+            Product.sku.in_(new_skus)
+        )) if new_skus else {}
+        openings = [(product_id or created[sku], opening_stock, warehouse_id)
+                    for sku, product_id, opening_stock, warehouse_id in openings]
+        current = stock_matrix({product_id for product_id, _, _ in openings})
+
+        now = datetime.utcnow()
+        movements, deltas = [], {}
+        for product_id, opening_stock, warehouse_id in openings:
+            key = (product_id, warehouse_id)
+            delta = opening_stock - current[product_id].get(warehouse_id, 0) - deltas.get(key, 0)
+            if delta == 0:
+                continue
+            deltas[key] = deltas.get(key, 0) + delta
+            movements.append({
+                'product_id': product_id,
+                'warehouse_id': warehouse_id,
+                'quantity': delta,
+                'operation_type': 'opening_balance',
+                'reference': 'IMPORT',
+                'notes': 'Opening balance (import)',
+                'created_at': now,
+                'created_by': self.user_id
+            })
+
+        if movements:
+            value_movements(movements)
+            db.session.execute(insert(StockMovement.__table__), movements)
+            apply_balance_deltas(deltas)
+        return len(movements)
+
+
+def import_catalog(stream, fmt='csv', error_stream=None, **options):
+    """Import a catalog file. Returns the summary counters.
+
+    `error_stream`, if given, receives a CSV report of rejected rows.
+    """
+    error_writer = None
+    if error_stream is not None:
+        error_writer = csv.DictWriter(error_stream, fieldnames=ERROR_REPORT_FIELDS)
+        error_writer.writeheader()
+
+    importer = CatalogImporter(error_writer=error_writer, **options)
+    return importer.run(iter_records(stream, fmt))
@@ -0,0 +1,181 @@
+"""Demand forecasts for the whole catalog, computed together with NumPy.
+
+One grouped query reads each product's outgoing quantity per day over the
+last FORECAST_HISTORY_WEEKS whole weeks (deliveries and stock write-offs;
+transfers only move stock between warehouses and are left out). From that
+products x days matrix, for every product at once:
+
+- moving_average: mean daily usage over the last FORECAST_MOVING_AVERAGE_DAYS;
+- weekday index: each weekday's share of the product's usage;
+- smoothed_usage: exponentially smoothed (FORECAST_SMOOTHING) daily usage
+  with the weekday pattern taken out;
+- weekday_usage: smoothed usage times the weekday index, Monday first; its
+  mean is daily_usage.
+
+refresh_forecasts replaces product_forecasts in the caller's transaction;
+`flask forecast-demand` runs it and must be scheduled (e.g. nightly). Readers
+go through current_usage: a product whose forecast is missing or older than
+FORECAST_MAX_AGE_HOURS falls back to its live average usage over the last
+FORECAST_MOVING_AVERAGE_DAYS, spread evenly over the week. days_left walks
+the weekday forecast forward from today.
+"""
+from datetime import datetime, timedelta
+import numpy as np
+from flask import current_app
+from sqlalchemy import Integer, cast, delete, func, insert, literal
+from app import db
+from app.models import ProductForecast, StockMovement
+from app.services.bulk import fetch_tuples
+
+DEMAND_TYPES = ('delivery', 'adjustment')
+
+
+def demand_query(start, days):
+    """(product_id, day offset from `start`, outgoing quantity) per product and day."""
+    day = cast(func.julianday(StockMovement.created_at) - func.julianday(literal(f'{start:%Y-%m-%d}')), Integer)
+    return db.session.query(
+        StockMovement.product_id, day, func.sum(-StockMovement.quantity)
+    ).filter(
+        StockMovement.created_at >= start,
+        StockMovement.created_at < start + timedelta(days=days),
+        StockMovement.quantity < 0,
+        StockMovement.operation_type.in_(DEMAND_TYPES)
+    ).group_by(StockMovement.product_id + 0, day)
+
+
+def demand_matrix(start, days):
+    """(product_ids, usage): usage[i, d] is product_ids[i]'s outgoing quantity on day start + d."""
+    rows = fetch_tuples(demand_query(start, days))
+
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.zeros((0, days))
+    data = np.array(rows, dtype=[('product_id', np.int64), ('day', np.int64), ('quantity', float)])
+    product_ids, row_index = np.unique(data['product_id'], return_inverse=True)
+    cells = row_index * days + np.clip(data['day'], 0, days - 1)
+    usage = np.bincount(cells, weights=data['quantity'], minlength=len(product_ids) * days)
+    usage = usage.reshape(len(product_ids), days)
+    return product_ids, usage
+
+
+def forecast_usage(usage, start_weekday, moving_average_days=30, alpha=0.2):
+    """Forecast arrays for a products x days usage matrix whose first day is `start_weekday` (Monday = 0).
+
+    The day count must be a whole number of weeks.
+    """
+    days = usage.shape[1]
+    weekdays = (start_weekday + np.arange(days)) % 7
+    moving_average = usage[:, -moving_average_days:].mean(axis=1)
+
+    by_weekday = np.stack([usage[:, weekdays == weekday].mean(axis=1) for weekday in range(7)], axis=1)
+    mean = by_weekday.mean(axis=1, keepdims=True)
+    index = np.divide(by_weekday, mean, out=np.ones_like(by_weekday), where=mean > 0)
+
+    # Weekdays that never see usage say nothing about the level; they count
+    # as an average day.
+    daily_index = index[:, weekdays]
+    deseasonalized = np.divide(usage, daily_index, out=np.repeat(mean, days, axis=1), where=daily_index > 0)
+    # level_t = alpha * x_t + (1 - alpha) * level_t-1, seeded with day 0,
+    # unrolled into one weight per day: a single matrix-vector product.
+    weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1)
+    weights[0] = (1 - alpha) ** (days - 1)
+    smoothed = deseasonalized @ weights
+
+    weekday_usage = smoothed[:, None] * index
+    return {
+        'moving_average': moving_average,
+        'smoothed_usage': smoothed,
+        'weekday_usage': weekday_usage,
+        'daily_usage': weekday_usage.mean(axis=1)
+    }
+
+
+def days_left(stock, weekday_usage, weekday):
+    """Days until each stock level runs out at its weekday forecast (Monday first), starting on `weekday`.
+
+    inf where the forecast has no usage.
+    """
+    stock = np.maximum(np.asarray(stock, dtype=float), 0)
+    week = np.roll(np.asarray(weekday_usage, dtype=float).reshape(len(stock), 7), -weekday, axis=1)
+    cumulative = np.cumsum(week, axis=1)
+    weekly = cumulative[:, -1]
+    rows = np.arange(len(stock))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        full_weeks = np.floor(stock / weekly)
+        rest = stock - full_weeks * weekly
+        whole_days = np.minimum((cumulative <= rest[:, None]).sum(axis=1), 6)
+        used = np.where(whole_days > 0, cumulative[rows, whole_days - 1], 0)
+        fraction = np.clip(np.nan_to_num((rest - used) / week[rows, whole_days]), 0, 1)
+        result = full_weeks * 7 + whole_days + fraction
+    return np.where(weekly > 0, result, np.inf)
+
+
+def refresh_forecasts(now=None):
+    """Recompute and store every product's forecast (does not commit). Returns the number stored."""
+    config = current_app.config
+    today = (now or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+    days = config['FORECAST_HISTORY_WEEKS'] * 7
+    start = today - timedelta(days=days)
+
+    product_ids, usage = demand_matrix(start, days)
+    forecast = forecast_usage(usage, start.weekday(), config['FORECAST_MOVING_AVERAGE_DAYS'],
+                              config['FORECAST_SMOOTHING'])
+
+    computed_at = datetime.utcnow()
+    rows = [{
+        'product_id': product_id,
+        'moving_average': moving_average,
+        'smoothed_usage': smoothed,
+        'daily_usage': daily,
+        'weekday_usage': weekday_usage,
+        'computed_at': computed_at
+    } for product_id, moving_average, smoothed, daily, weekday_usage in zip(
+        product_ids.tolist(), forecast['moving_average'].tolist(), forecast['smoothed_usage'].tolist(),
+        forecast['daily_usage'].tolist(), forecast['weekday_usage'].tolist()
+    )]
+
+    db.session.execute(delete(ProductForecast))
+    if rows:
+        db.session.execute(insert(ProductForecast.__table__), rows)
+    return len(rows)
+
+
+
+def live_usage_query(days):
+    """(product_id, outgoing quantity) per product over the last `days` days."""
+    # Grouping on an expression keeps SQLite from walking the whole
+    # (product_id, ...) index and lets it range-search on created_at instead.
+    return db.session.query(
+        StockMovement.product_id, func.sum(-StockMovement.quantity)
+    ).filter(
+        StockMovement.created_at >= datetime.utcnow() - timedelta(days=days),
+        StockMovement.quantity < 0,
+        StockMovement.operation_type.in_(DEMAND_TYPES)
+    ).group_by(StockMovement.product_id + 0)
+
+
+def forecast_cutoff():
+    """Stored forecasts computed before this are stale."""
+    return datetime.utcnow() - timedelta(hours=current_app.config['FORECAST_MAX_AGE_HOURS'])
+
+
+def current_usage(product_ids=None):
+    """{product_id: (daily_usage, weekday_usage)} for `product_ids` (default: every product).
+
+    Fresh stored forecasts are used as they are; other products get their
+    live average. Products without usage are left out.
+    """
+    days = current_app.config['FORECAST_MOVING_AVERAGE_DAYS']
+    forecasts = db.session.query(
+        ProductForecast.product_id, ProductForecast.daily_usage, ProductForecast.weekday_usage
+    ).filter(ProductForecast.computed_at >= forecast_cutoff())
+    live = live_usage_query(days)
+    if product_ids is not None:
+        forecasts = forecasts.filter(ProductForecast.product_id.in_(product_ids))
+        live = live.filter(StockMovement.product_id.in_(product_ids))
+
+    usage = {product_id: (daily, weekday) for product_id, daily, weekday in forecasts}
+    for product_id, outgoing in live:
+        if product_id not in usage and outgoing > 0:
+            usage[product_id] = (outgoing / days, [outgoing / days] * 7)
+    return usage
@@ -0,0 +1,104 @@
+"""Ledger checkpoints: keep stock_movements bounded to a retention window.
+
+A checkpoint moves every movement older than its cutoff into
+stock_movements_archive (ids unchanged) and adds it to opening_balances, the
+per-(product, warehouse) stock as of the cutoff. The work is done oldest
+first in chunks, each its own write transaction that archives, folds in and
+deletes the same rows, so the ledger is consistent after every commit and an
+interrupted run can simply be repeated.
+
+Across the boundary: opening_balances + stock_movements is the stock
+(rebuild_stock_balances), and every archived (created_at, id) key sorts below
+the live table's, so history and exports page through both with the same
+keys. Usage and forecasts only read the live table, hence MIN_RETENTION_DAYS.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import delete, desc, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import db
+from app.models import StockMovement, ArchivedMovement, OpeningBalance, LedgerCheckpoint
+from app.services.writer import run_inline
+
+# Longest window read from stock_movements alone (8-week demand forecast), with margin.
+MIN_RETENTION_DAYS = 90
+
+
+def latest_checkpoint():
+    return LedgerCheckpoint.query.order_by(desc(LedgerCheckpoint.cutoff)).first()
+
+
+def retention_cutoff(retention_days):
+    """Start of the day `retention_days` ago (UTC)."""
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=retention_days)
+
+
+def archive_chunk(cutoff, chunk_size):
+    """Archive the oldest movements before `cutoff`, at most `chunk_size`. Returns how many moved."""
+    ids = [movement_id for movement_id, in db.session.query(StockMovement.id).filter(
+        StockMovement.created_at < cutoff
+    ).order_by(StockMovement.created_at, StockMovement.id).limit(chunk_size)]
+    if not ids:
+        return 0
+
+    hot = StockMovement.__table__
+    chunk = hot.c.id.in_(ids)
+    db.session.execute(insert(ArchivedMovement.__table__).from_select(
+        [column.name for column in hot.c], select(*hot.c).where(chunk)
+    ))
+
+    totals = db.session.execute(select(
+        hot.c.product_id, hot.c.warehouse_id, func.sum(hot.c.quantity)
+    ).where(chunk).group_by(hot.c.product_id, hot.c.warehouse_id)).all()
+    stmt = sqlite_insert(OpeningBalance)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[OpeningBalance.product_id, OpeningBalance.warehouse_id],
+        set_={'quantity': OpeningBalance.quantity + stmt.excluded.quantity}
+    )
+    db.session.execute(stmt, [
+        {'product_id': product_id, 'warehouse_id': warehouse_id, 'quantity': quantity}
+        for product_id, warehouse_id, quantity in totals
+    ])
+
+    db.session.execute(delete(hot).where(chunk))
+    return len(ids)
+
+
+def record_checkpoint(cutoff, archived):
+    db.session.add(LedgerCheckpoint(cutoff=cutoff, movements_archived=archived))
+
+
+def checkpoint_ledger(cutoff, chunk_size=5000, submit=None):
+    """Archive every movement before `cutoff` and record the checkpoint. Returns the number archived.
+
+    `submit(fn, *args)` runs each chunk in a write transaction (run_inline by
+    default). Raises ValueError for a cutoff inside MIN_RETENTION_DAYS or
+    before the latest checkpoint.
+    """
+    if cutoff > retention_cutoff(MIN_RETENTION_DAYS):
+        raise ValueError(f'Cutoff must be at least {MIN_RETENTION_DAYS} days in the past')
+    latest = latest_checkpoint()
+    if latest and cutoff < latest.cutoff:
+        raise ValueError(f'Cutoff is before the latest checkpoint ({latest.cutoff:%Y-%m-%d})')
+
+    submit = submit or run_inline
+    archived = 0
+    while True:
+        moved = submit(archive_chunk, cutoff, chunk_size)
+        archived += moved
+        if moved < chunk_size:
+            break
+    submit(record_checkpoint, cutoff, archived)
+    return archived
+
+
+def recent_movements(product_id, limit=20):
+    """A product's latest movements, newest first, topped up from the archive if needed."""
+    movements = StockMovement.query.filter_by(product_id=product_id).order_by(
+        desc(StockMovement.created_at), desc(StockMovement.id)
+    ).limit(limit).all()
+    if len(movements) < limit:
+        movements += ArchivedMovement.query.filter_by(product_id=product_id).order_by(
+            desc(ArchivedMovement.created_at), desc(ArchivedMovement.id)
+        ).limit(limit - len(movements)).all()
+    return movements
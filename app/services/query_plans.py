@@ -0,0 +1,113 @@
+"""EXPLAIN QUERY PLAN regression checks for the hot read paths.
+
+Each entry builds the same statement the application issues; the check fails
+when SQLite would answer it with a full table SCAN or sort its result with a
+temporary B-tree instead of walking an index. Walking a whole index is only
+accepted for ordered, LIMITed list queries (`ordered=True`), where SQLite
+stops after the first page.
+"""
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import desc, or_, tuple_
+from app import db
+from app.models import (Product, StockBalance, StockMovement, ArchivedMovement, DailyStock,
+                        Receipt, Delivery, Transfer, Adjustment)
+from app.services.stock import stock_totals_query
+from app.services.ledger_export import ledger_chunk_query, ledger_filters
+from app.services.timeline import recent_operations_query
+from app.services.forecast import demand_query, live_usage_query
+from app.services.snapshots import latest_closing_query
+from app.services.replenishment import open_transfers_query
+from app.services.analytics import window_start_query, movement_chunk_query
+
+TABLE_SCAN = re.compile(r'^SCAN (?!.*\bUSING (COVERING )?INDEX\b)')
+INDEX_SCAN = re.compile(r'^SCAN .*\bUSING (COVERING )?INDEX\b')
+TEMP_SORT = re.compile(r'USE TEMP B-TREE FOR (LAST TERM OF )?ORDER BY')
+
+
+def _document_list(model, status=None, after=None):
+    query = model.query
+    if status:
+        query = query.filter_by(status=status)
+    if after:
+        query = query.filter(tuple_(model.created_at, model.id) < tuple_(*after))
+    return query.order_by(desc(model.created_at), desc(model.id)).limit(21)
+
+
+def hot_queries():
+    """(name, query, ordered) for every hot read path."""
+    cutoff_date = datetime.utcnow() - timedelta(days=30)
+    return [
+        ('product stock', stock_totals_query().filter(StockBalance.product_id == 1), False),
+        ('product stock in warehouse', stock_totals_query(1).filter(StockBalance.product_id == 1), False),
+        ('catalog live usage', live_usage_query(30), False),
+        ('product live usage', live_usage_query(30).filter(StockMovement.product_id.in_([1, 2])), False),
+        ('demand forecast matrix', demand_query(cutoff_date, 56), False),
+        ('product stock as of', latest_closing_query(cutoff_date.date(), 1), False),
+        ('product daily series', db.session.query(DailyStock.day, DailyStock.quantity_in).filter(
+            DailyStock.product_id == 1, DailyStock.day >= cutoff_date.date()
+        ), False),
+        ('catalog daily series', db.session.query(DailyStock.day, DailyStock.quantity_in).filter(
+            DailyStock.day >= cutoff_date.date()
+        ), False),
+        ('product recent movements', StockMovement.query.filter_by(product_id=1).order_by(
+            desc(StockMovement.created_at), desc(StockMovement.id)
+        ).limit(20), False),
+        ('product movements in warehouse', StockMovement.query.filter_by(product_id=1, warehouse_id=1), False),
+        ('move history', _document_list(StockMovement), True),
+        ('move history page', _document_list(StockMovement, after=(cutoff_date, 1)), True),
+        ('archived move history page', _document_list(ArchivedMovement, after=(cutoff_date, 1)), True),
+        ('product archived movements', ArchivedMovement.query.filter_by(product_id=1).order_by(
+            desc(ArchivedMovement.created_at), desc(ArchivedMovement.id)
+        ).limit(20), False),
+        ('checkpoint chunk', db.session.query(StockMovement.id).filter(
+            StockMovement.created_at < cutoff_date
+        ).order_by(StockMovement.created_at, StockMovement.id).limit(5000), True),
+        ('recent operations', recent_operations_query(), True),
+        ('receipts list', _document_list(Receipt), True),
+        ('receipts page', _document_list(Receipt, after=(cutoff_date, 1)), True),
+        ('receipts by status', _document_list(Receipt, 'draft'), False),
+        ('receipts by status page', _document_list(Receipt, 'draft', (cutoff_date, 1)), False),
+        ('deliveries list', _document_list(Delivery), True),
+        ('deliveries by status', _document_list(Delivery, 'draft'), False),
+        ('transfers list', _document_list(Transfer), True),
+        ('adjustments list', _document_list(Adjustment), True),
+        ('products list', Product.query.filter_by(is_active=True).order_by(
+            desc(Product.created_at), desc(Product.id)
+        ).limit(21), True),
+        ('pending receipts', Receipt.query.filter(Receipt.status.in_(['draft', 'waiting'])), False),
+        ('open transfer lines', open_transfers_query(), False),
+        ('analytics window start', window_start_query(cutoff_date), True),
+        ('analytics movement chunk', movement_chunk_query(cutoff_date, 1, 100001), False),
+        ('product by barcode', Product.query.filter_by(barcode='0000', is_active=True), False),
+        ('resolve scanned codes', Product.query.filter(
+            Product.is_active == True,
+            or_(Product.barcode.in_(['0000', '0001']), Product.sku.in_(['0000', '0001']))
+        ), False),
+        ('ledger export chunk', ledger_chunk_query(ledger_filters(start='2000-01-01'), (cutoff_date, 1)), False),
+        ('product ledger export chunk', ledger_chunk_query(ledger_filters(product_id=1), (cutoff_date, 1)), False),
+        ('archived ledger export chunk', ledger_chunk_query(
+            ledger_filters(product_id=1, model=ArchivedMovement), (cutoff_date, 1), model=ArchivedMovement
+        ), False),
+    ]
+
+
+def explain(query):
+    """Return the EXPLAIN QUERY PLAN detail lines for an ORM query or Core statement."""
+    statement = getattr(query, 'statement', query)
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params)
+    return [row[-1] for row in rows]
+
+
+def check_query_plans():
+    """Yield (name, plan lines, problems) for every hot query."""
+    for name, query, ordered in hot_queries():
+        plan = explain(query)
+        problems = [
+            line for line in plan
+            if TABLE_SCAN.search(line) or TEMP_SORT.search(line)
+            or (not ordered and INDEX_SCAN.search(line))
+        ]
+        yield name, plan, problems
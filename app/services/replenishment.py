@@ -0,0 +1,205 @@
+"""Multi-warehouse replenishment planning.
+
+Each warehouse gets a share of a product's minimum and ideal stock equal to
+its share of the product's recent demand (deliveries and write-offs over
+FORECAST_HISTORY_WEEKS). Products without demand keep their current split;
+with no stock at all they are bought into the receiving warehouse.
+
+Available stock counts open (draft or waiting) documents: receipts and
+incoming transfers add to a warehouse, deliveries and outgoing transfers take
+from it. Running the planner again therefore does not repeat proposals that
+are still open.
+
+A warehouse below its minimum needs stock up to its ideal (rounded up to
+whole units). One holding more than its ideal can give the excess (rounded
+down), counting only free stock: on hand, less what open deliveries and
+transfers already take, with nothing still to arrive. Per
+product the largest surplus goes to the largest need first. Every pair of
+warehouses costs the same, so this greedy matching also keeps the number of
+transfer lines low. Needs that surpluses cannot cover go on the purchase
+list. Stock, demand and open documents are each read with one grouped query
+into products x warehouses NumPy matrices.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+import csv
+import io
+import uuid
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, insert
+from app import db
+from app.models import (Product, Warehouse, StockBalance, StockMovement, Receipt, ReceiptLine,
+                        Delivery, DeliveryLine, Transfer, TransferLine)
+from app.services.bulk import fetch_tuples
+from app.services.forecast import DEMAND_TYPES
+
+OPEN_STATUSES = ('draft', 'waiting')
+PURCHASE_COLUMNS = ['product_id', 'sku', 'product_name', 'warehouse_id', 'warehouse_name', 'quantity']
+
+
+def _matrix(rows, product_ids, warehouse_ids):
+    """Sum (product_id, warehouse_id, quantity) rows into a products x warehouses matrix, dropping other ids."""
+    matrix = np.zeros((len(product_ids), len(warehouse_ids)))
+    rows = [row for row in rows if row[2]]
+    if not rows or not len(product_ids) or not len(warehouse_ids):
+        return matrix
+    data = np.array(rows, dtype=[('product_id', np.int64), ('warehouse_id', np.int64), ('quantity', float)])
+    products = np.minimum(np.searchsorted(product_ids, data['product_id']), len(product_ids) - 1)
+    warehouses = np.minimum(np.searchsorted(warehouse_ids, data['warehouse_id']), len(warehouse_ids) - 1)
+    known = (product_ids[products] == data['product_id']) & (warehouse_ids[warehouses] == data['warehouse_id'])
+    np.add.at(matrix, (products[known], warehouses[known]), data['quantity'][known])
+    return matrix
+
+
+def open_transfers_query():
+    """(product_id, source, destination, quantity) summed over the lines of open transfers."""
+    return db.session.query(
+        TransferLine.product_id, Transfer.source_warehouse_id, Transfer.dest_warehouse_id, func.sum(TransferLine.quantity)
+    ).join(Transfer, Transfer.id == TransferLine.transfer_id).filter(
+        Transfer.status.in_(OPEN_STATUSES)
+    ).group_by(TransferLine.product_id, Transfer.source_warehouse_id, Transfer.dest_warehouse_id)
+
+
+def open_document_rows():
+    """(incoming, outgoing): (product_id, warehouse_id, quantity) rows of open document lines, signed by their effect."""
+    incoming = fetch_tuples(db.session.query(ReceiptLine.product_id, Receipt.warehouse_id, func.sum(ReceiptLine.quantity)).join(
+        Receipt, Receipt.id == ReceiptLine.receipt_id
+    ).filter(Receipt.status.in_(OPEN_STATUSES)).group_by(ReceiptLine.product_id, Receipt.warehouse_id))
+    outgoing = fetch_tuples(db.session.query(DeliveryLine.product_id, Delivery.warehouse_id, -func.sum(DeliveryLine.quantity)).join(
+        Delivery, Delivery.id == DeliveryLine.delivery_id
+    ).filter(Delivery.status.in_(OPEN_STATUSES)).group_by(DeliveryLine.product_id, Delivery.warehouse_id))
+    for product_id, source_id, dest_id, quantity in fetch_tuples(open_transfers_query()):
+        outgoing.append((product_id, source_id, -quantity))
+        incoming.append((product_id, dest_id, quantity))
+    return incoming, outgoing
+
+
+def plan_replenishment(receiving_warehouse_id=None):
+    """Propose transfers and purchases for every active product and warehouse.
+
+    Products with no demand or stock are bought into `receiving_warehouse_id`
+    (default: the first active warehouse). Returns {'transfers':
+    [{'source_warehouse_id', 'dest_warehouse_id', 'lines': [{'product_id',
+    'quantity'}]}], 'purchases': [{'product_id', 'warehouse_id', 'quantity'}]}.
+    """
+    products = db.session.query(Product.id, Product.minimum_stock, Product.ideal_stock).filter(
+        Product.is_active == True
+    ).order_by(Product.id).all()
+    warehouse_ids = np.array([warehouse_id for warehouse_id, in db.session.query(Warehouse.id).filter(
+        Warehouse.is_active == True
+    ).order_by(Warehouse.id)], dtype=np.int64)
+    if not products or not len(warehouse_ids):
+        return {'transfers': [], 'purchases': []}
+
+    product_ids = np.array([row[0] for row in products], dtype=np.int64)
+    minimum_stock = np.array([row[1] or 0 for row in products], dtype=float)
+    ideal_stock = np.maximum(np.array([row[2] or 0 for row in products], dtype=float), minimum_stock)
+
+    incoming, outgoing = open_document_rows()
+    free = _matrix(fetch_tuples(db.session.query(StockBalance.product_id, StockBalance.warehouse_id,
+                                                 StockBalance.quantity)), product_ids, warehouse_ids)
+    free += _matrix(outgoing, product_ids, warehouse_ids)
+    available = free + _matrix(incoming, product_ids, warehouse_ids)
+    since = datetime.utcnow() - timedelta(weeks=current_app.config['FORECAST_HISTORY_WEEKS'])
+    demand = _matrix(fetch_tuples(db.session.query(
+        StockMovement.product_id, StockMovement.warehouse_id, func.sum(-StockMovement.quantity)
+    ).filter(
+        StockMovement.created_at >= since,
+        StockMovement.quantity < 0,
+        StockMovement.operation_type.in_(DEMAND_TYPES)
+    ).group_by(StockMovement.product_id + 0, StockMovement.warehouse_id)), product_ids, warehouse_ids)
+
+    # Target split: demand share, else the current split, else all to the receiving warehouse.
+    weights = np.where(demand.sum(axis=1, keepdims=True) > 0, demand, np.maximum(available, 0))
+    receiving = np.flatnonzero(warehouse_ids == receiving_warehouse_id)
+    weights[weights.sum(axis=1) == 0, receiving[0] if len(receiving) else 0] = 1
+    share = weights / weights.sum(axis=1, keepdims=True)
+    minimum = minimum_stock[:, None] * share
+    ideal = ideal_stock[:, None] * share
+
+    need = np.where(available < minimum - 1e-9, np.ceil(ideal - available - 1e-9), 0)
+    surplus = np.where(free > ideal, np.floor(free - ideal + 1e-9), 0)
+
+    transfers = defaultdict(list)
+    for row in np.flatnonzero((need > 0).any(axis=1) & (surplus > 0).any(axis=1)):
+        needs = sorted(((need[row, column], column) for column in np.flatnonzero(need[row] > 0)), reverse=True)
+        givers = sorted(((surplus[row, column], column) for column in np.flatnonzero(surplus[row] > 0)), reverse=True)
+        needs, givers = [list(item) for item in needs], [list(item) for item in givers]
+        taker_index = giver_index = 0
+        while taker_index < len(needs) and giver_index < len(givers):
+            taker, giver = needs[taker_index], givers[giver_index]
+            quantity = min(taker[0], giver[0])
+            transfers[(giver[1], taker[1])].append({'product_id': int(product_ids[row]), 'quantity': float(quantity)})
+            taker[0] -= quantity
+            giver[0] -= quantity
+            need[row, taker[1]] -= quantity
+            taker_index += taker[0] <= 0
+            giver_index += giver[0] <= 0
+
+    purchase_rows, purchase_columns = np.nonzero(need > 0)
+    return {
+        'transfers': [{
+            'source_warehouse_id': int(warehouse_ids[source]),
+            'dest_warehouse_id': int(warehouse_ids[dest]),
+            'lines': lines
+        } for (source, dest), lines in sorted(transfers.items())],
+        'purchases': [{
+            'product_id': int(product_ids[row]),
+            'warehouse_id': int(warehouse_ids[column]),
+            'quantity': float(need[row, column])
+        } for row, column in zip(purchase_rows.tolist(), purchase_columns.tolist())]
+    }
+
+
+def create_transfer_drafts(transfers, user_id=None):
+    """Create one draft Transfer per (source, destination) pair of a plan (does not commit).
+
+    References are RPL-<date>-<transfer id>, so applying a plan twice never
+    repeats one. Returns [{'id', 'reference', 'lines'}].
+    """
+    now = datetime.utcnow()
+    created, lines = [], []
+    for proposal in transfers:
+        transfer = Transfer(
+            reference=f'RPL-{uuid.uuid4().hex}',
+            source_warehouse_id=proposal['source_warehouse_id'],
+            dest_warehouse_id=proposal['dest_warehouse_id'],
+            notes='Proposed by the replenishment planner',
+            created_by=user_id,
+            created_at=now
+        )
+        db.session.add(transfer)
+        db.session.flush()
+        transfer.reference = f'RPL-{now:%Y%m%d}-{transfer.id}'
+        lines += [dict(line, transfer_id=transfer.id) for line in proposal['lines']]
+        created.append({'id': transfer.id, 'reference': transfer.reference, 'lines': len(proposal['lines'])})
+    if lines:
+        db.session.execute(insert(TransferLine.__table__), lines)
+    return created
+
+
+def apply_plan(receiving_warehouse_id=None, user_id=None):
+    """Plan and create the draft transfers in one write transaction (does not commit).
+
+    Run it through the write queue (or run_inline), so concurrent applies see
+    each other's drafts instead of giving away the same surplus twice.
+    Returns {'transfers': [{'id', 'reference', 'lines'}], 'purchases'}.
+    """
+    plan = plan_replenishment(receiving_warehouse_id)
+    return {'transfers': create_transfer_drafts(plan['transfers'], user_id), 'purchases': plan['purchases']}
+
+
+def purchase_csv(purchases):
+    """The purchase list as CSV text, with product and warehouse names."""
+    products = {product_id: (sku, name) for product_id, sku, name in
+                db.session.query(Product.id, Product.sku, Product.name)}
+    warehouses = dict(db.session.query(Warehouse.id, Warehouse.name))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(PURCHASE_COLUMNS)
+    for purchase in purchases:
+        sku, name = products[purchase['product_id']]
+        writer.writerow([purchase['product_id'], sku, name, purchase['warehouse_id'],
+                         warehouses[purchase['warehouse_id']], purchase['quantity']])
+    return buffer.getvalue()
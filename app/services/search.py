@@ -0,0 +1,95 @@
+"""Ranked product search backed by an SQLite FTS5 index.
+
+`products_fts` holds one row per product (rowid = product id) with its name,
+SKU, barcode, description and category name. Triggers on `products` and
+`categories` keep it in sync with every write, including bulk imports.
+Each query token is matched as a prefix and all tokens must match; results
+are ordered by bm25 with name, SKU and barcode weighted over the rest. When
+the SQLite build has no FTS5 the search falls back to ilike matching.
+"""
+import re
+from sqlalchemy import column, func, literal_column, or_, table, text
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.models import Product
+
+FTS_TABLE = 'products_fts'
+# bm25 column weights: name, sku, barcode, description, category.
+RANK_WEIGHTS = (10.0, 6.0, 6.0, 1.0, 2.0)
+
+_INDEXED = ("new.id, new.name, new.sku, coalesce(new.barcode, ''), coalesce(new.description, ''), "
+            "coalesce((SELECT name FROM categories WHERE id = new.category_id), '')")
+
+FTS_STATEMENTS = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "name, sku, barcode, description, category, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN "
+    f"INSERT INTO {FTS_TABLE} (rowid, name, sku, barcode, description, category) SELECT {_INDEXED}; END",
+    f"CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE ON products BEGIN "
+    f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; "
+    f"INSERT INTO {FTS_TABLE} (rowid, name, sku, barcode, description, category) SELECT {_INDEXED}; END",
+    f"CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN "
+    f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END",
+    f"CREATE TRIGGER IF NOT EXISTS categories_fts_update AFTER UPDATE OF name ON categories BEGIN "
+    f"UPDATE {FTS_TABLE} SET category = new.name "
+    f"WHERE rowid IN (SELECT id FROM products WHERE category_id = new.id); END",
+]
+
+fts = table(FTS_TABLE, column('rowid'), column(FTS_TABLE))
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def create_product_fts(conn):
+    """Migration step: create the index and triggers, then index existing products.
+
+    Skipped (leaving the ilike fallback) when SQLite was built without FTS5.
+    """
+    try:
+        conn.execute(text(FTS_STATEMENTS[0]))
+    except OperationalError:
+        return
+    for statement in FTS_STATEMENTS[1:]:
+        conn.execute(text(statement))
+    rebuild_product_fts(conn)
+
+
+def rebuild_product_fts(conn):
+    conn.execute(text(f'DELETE FROM {FTS_TABLE}'))
+    conn.execute(text(
+        f"INSERT INTO {FTS_TABLE} (rowid, name, sku, barcode, description, category) "
+        "SELECT p.id, p.name, p.sku, coalesce(p.barcode, ''), coalesce(p.description, ''), "
+        "coalesce(c.name, '') FROM products p LEFT JOIN categories c ON c.id = p.category_id"
+    ))
+
+
+def fts_enabled():
+    return db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}
+    ).first() is not None
+
+
+def match_expression(search):
+    """FTS5 query requiring every token of `search` as a prefix, or None if it has no tokens."""
+    tokens = TOKEN.findall(search)
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_products(query, search):
+    """Filter a Product query to matches for `search`, best first."""
+    if not fts_enabled():
+        pattern = f'%{search}%'
+        return query.filter(
+            or_(Product.name.ilike(pattern), Product.sku.ilike(pattern), Product.barcode.ilike(pattern))
+        ).order_by(Product.name, Product.id)
+
+    match = match_expression(search)
+    if match is None:
+        return query.filter(db.false())
+    rank = func.bm25(literal_column(FTS_TABLE), *RANK_WEIGHTS)
+    return query.join(fts, fts.c.rowid == Product.id).filter(
+        fts.c[FTS_TABLE].op('MATCH')(match)
+    ).order_by(rank, Product.id)
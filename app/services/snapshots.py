@@ -0,0 +1,193 @@
+"""Daily stock rollups and point-in-time ("as of") stock.
+
+daily_stock holds one row per (product, warehouse, day) with movements: the
+quantities in and out and the closing balance. roll_up_stock appends every
+complete day after the last rolled-up one, oldest first, a chunk of days
+per transaction (STOCK_ROLLUP_CHUNK_DAYS). Its starting balances are
+stock_balances minus the movements since, so earlier rollup rows are never
+re-read.
+
+stock_as_of(at) takes, per balance, the latest rollup row before the day of
+`at` (one primary-key seek) and adds the ledger movements from the start of
+that day up to `at`, plus any days not rolled up yet. The archive is read
+too, so dates before the latest ledger checkpoint work the same way.
+"""
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import case, func, insert, select, union_all
+from app import db
+from app.models import DailyStock, StockBalance
+from app.services.ledger_export import LEDGER_MODELS
+from app.services.writer import run_inline
+
+
+def ledger_rows(start=None, end=None, product_id=None, warehouse_id=None):
+    """Live and archived movements in [start, end) as one subquery.
+
+    Columns: product_id, warehouse_id, quantity, created_at.
+    """
+    selects = []
+    for model in LEDGER_MODELS:
+        query = select(model.product_id, model.warehouse_id, model.quantity, model.created_at)
+        if start:
+            query = query.where(model.created_at >= start)
+        if end:
+            query = query.where(model.created_at < end)
+        if product_id:
+            query = query.where(model.product_id == product_id)
+        if warehouse_id:
+            query = query.where(model.warehouse_id == warehouse_id)
+        selects.append(query)
+    return union_all(*selects).subquery()
+
+
+def ledger_net(start=None, end=None, product_id=None, warehouse_id=None):
+    """{(product_id, warehouse_id): net quantity} of the movements in [start, end)."""
+    ledger = ledger_rows(start, end, product_id, warehouse_id)
+    rows = db.session.execute(select(
+        ledger.c.product_id, ledger.c.warehouse_id, func.sum(ledger.c.quantity)
+    ).group_by(ledger.c.product_id, ledger.c.warehouse_id))
+    return {(product_id, warehouse_id): quantity for product_id, warehouse_id, quantity in rows}
+
+
+def ledger_days(start, end, product_id=None, warehouse_id=None, by_key=True):
+    """(product_id, warehouse_id, day, in, out) per key and day in [start, end), oldest first.
+
+    With `by_key` off the rows are (day, in, out), summed over the keys.
+    """
+    ledger = ledger_rows(start, end, product_id, warehouse_id)
+    day = func.date(ledger.c.created_at)
+    keys = [ledger.c.product_id, ledger.c.warehouse_id] if by_key else []
+    rows = db.session.execute(select(
+        *keys, day,
+        func.sum(case((ledger.c.quantity > 0, ledger.c.quantity), else_=0)),
+        func.sum(case((ledger.c.quantity < 0, -ledger.c.quantity), else_=0))
+    ).group_by(*keys, day).order_by(day)).all()
+    return [row[:-3] + (date.fromisoformat(row[-3]),) + row[-2:] for row in rows]
+
+
+def day_start(day):
+    return datetime.combine(day, time.min)
+
+
+def rolled_through():
+    """Last day with rollup rows, or None."""
+    return db.session.query(func.max(DailyStock.day)).scalar()
+
+
+def next_rollup_day():
+    last = rolled_through()
+    if last is not None:
+        return last + timedelta(days=1)
+    firsts = [db.session.query(func.min(model.created_at)).scalar() for model in LEDGER_MODELS]
+    firsts = [first for first in firsts if first is not None]
+    return min(firsts).date() if firsts else None
+
+
+def opening_state(day):
+    """{key: balance at the start of `day`}: current balances minus every movement since."""
+    state = {(product_id, warehouse_id): quantity for product_id, warehouse_id, quantity in
+             db.session.query(StockBalance.product_id, StockBalance.warehouse_id, StockBalance.quantity)}
+    for key, quantity in ledger_net(day_start(day)).items():
+        state[key] = state.get(key, 0) - quantity
+    return state
+
+
+def roll_up_range(start, end, state):
+    """Write rollup rows for the days in [start, end) (does not commit). Returns the balances at `end`."""
+    closing = dict(state)
+    rows = []
+    for product_id, warehouse_id, day, quantity_in, quantity_out in ledger_days(day_start(start), day_start(end)):
+        key = (product_id, warehouse_id)
+        closing[key] = closing.get(key, 0) + quantity_in - quantity_out
+        rows.append({'product_id': product_id, 'warehouse_id': warehouse_id, 'day': day,
+                     'quantity_in': quantity_in, 'quantity_out': quantity_out, 'closing': closing[key]})
+    if rows:
+        db.session.execute(insert(DailyStock.__table__), rows)
+    return closing
+
+
+def roll_up_stock(until=None, chunk_days=31, submit=None):
+    """Roll up every complete day before `until` (default: today) not rolled up yet. Returns the day count.
+
+    `submit(fn, *args)` runs each step in a write transaction (run_inline by default).
+    """
+    submit = submit or run_inline
+    end = (until or datetime.utcnow()).date()
+    start = next_rollup_day()
+    if start is None or start >= end:
+        return 0
+
+    state = submit(opening_state, start)
+    day = start
+    while day < end:
+        chunk_end = min(day + timedelta(days=chunk_days), end)
+        state = submit(roll_up_range, day, chunk_end, state)
+        day = chunk_end
+    return (end - start).days
+
+
+def rollup_boundary(day):
+    """First day at or before `day` whose stock must come from the ledger rather than the rollup."""
+    last = rolled_through()
+    if last is None:
+        return None
+    return min(day, last + timedelta(days=1))
+
+
+def latest_closing_query(boundary, product_id=None, warehouse_id=None):
+    """(product_id, warehouse_id, closing) per balance: its last rollup row before `boundary`."""
+    closing = select(DailyStock.closing).where(
+        DailyStock.product_id == StockBalance.product_id,
+        DailyStock.warehouse_id == StockBalance.warehouse_id,
+        DailyStock.day < boundary
+    ).order_by(DailyStock.day.desc()).limit(1).scalar_subquery()
+    query = db.session.query(StockBalance.product_id, StockBalance.warehouse_id, closing)
+    if product_id:
+        query = query.filter(StockBalance.product_id == product_id)
+    if warehouse_id:
+        query = query.filter(StockBalance.warehouse_id == warehouse_id)
+    return query
+
+
+def stock_as_of(at, product_id=None, warehouse_id=None):
+    """{(product_id, warehouse_id): quantity} at the moment `at`, leaving out zero balances."""
+    boundary = rollup_boundary(at.date())
+    stock = {}
+    if boundary is not None:
+        for key_product_id, key_warehouse_id, closing in latest_closing_query(boundary, product_id, warehouse_id):
+            if closing is not None:
+                stock[(key_product_id, key_warehouse_id)] = closing
+    since = day_start(boundary) if boundary is not None else None
+    for key, quantity in ledger_net(since, at, product_id, warehouse_id).items():
+        stock[key] = stock.get(key, 0) + quantity
+    return {key: quantity for key, quantity in stock.items() if quantity}
+
+
+def daily_series(start, end, product_id=None, warehouse_id=None):
+    """One {'day', 'in', 'out', 'closing'} per day from `start` to `end` (dates, inclusive)."""
+    opening = sum(stock_as_of(day_start(start), product_id, warehouse_id).values())
+    boundary = rollup_boundary(end + timedelta(days=1)) or start
+    totals = {}
+
+    if boundary > start:
+        query = db.session.query(
+            DailyStock.day, func.sum(DailyStock.quantity_in), func.sum(DailyStock.quantity_out)
+        ).filter(DailyStock.day >= start, DailyStock.day < boundary)
+        if product_id:
+            query = query.filter(DailyStock.product_id == product_id)
+        if warehouse_id:
+            query = query.filter(DailyStock.warehouse_id == warehouse_id)
+        totals.update((day, (quantity_in, quantity_out)) for day, quantity_in, quantity_out in
+                      query.group_by(DailyStock.day))
+    recent = ledger_days(day_start(max(start, boundary)), day_start(end + timedelta(days=1)),
+                         product_id, warehouse_id, by_key=False)
+    for day, quantity_in, quantity_out in recent:
+        totals[day] = (quantity_in, quantity_out)
+
+    series, closing = [], opening
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        quantity_in, quantity_out = totals.get(day, (0, 0))
+        closing += quantity_in - quantity_out
+        series.append({'day': day.isoformat(), 'in': quantity_in, 'out': quantity_out, 'closing': closing})
+    return series
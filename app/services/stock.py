@@ -0,0 +1,179 @@
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import bindparam, func, insert, null, select, tuple_, union_all, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import db
+from app.models import StockBalance, StockMovement, OpeningBalance
+from app.services.valuation import value_movements
+
+
+class StaleBalanceError(Exception):
+    pass
+
+
+def record_movements(rows, withdrawn=None):
+    """Write ledger rows (plain dicts) and apply them to stock_balances.
+
+    Runs inside the caller's transaction, so the ledger and the balances are
+    committed (or rolled back) together. Rows are inserted with a single
+    executemany. `withdrawn` is the mapping already taken off the balances
+    by withdraw_stock; it is not applied twice. Rows are costed and applied
+    to stock_valuations first (value_movements).
+    """
+    if not rows:
+        return
+
+    value_movements(rows)
+    db.session.execute(insert(StockMovement.__table__), rows)
+    deltas = defaultdict(float)
+    for row in rows:
+        deltas[(row['product_id'], row['warehouse_id'])] += row['quantity']
+    for key, quantity in (withdrawn or {}).items():
+        deltas[key] += quantity
+
+    apply_balance_deltas({key: delta for key, delta in deltas.items() if delta})
+
+
+def stock_levels(keys):
+    """{(product_id, warehouse_id): (quantity, version)} for the balances that exist."""
+    keys = list(keys)
+    if not keys:
+        return {}
+    return {
+        (product_id, warehouse_id): (quantity, version)
+        for product_id, warehouse_id, quantity, version in db.session.query(
+            StockBalance.product_id, StockBalance.warehouse_id, StockBalance.quantity, StockBalance.version
+        ).filter(tuple_(StockBalance.product_id, StockBalance.warehouse_id).in_(keys))
+    }
+
+
+def withdraw_stock(withdrawals):
+    """Take {(product_id, warehouse_id): quantity} off the balances, all or nothing.
+
+    Reads the affected balances in one query and, if every key has enough
+    stock, decrements them with one executemany UPDATE guarded by each row's
+    version and quantity. Returns {key: available} for the keys that are
+    short, in which case nothing is changed. Raises StaleBalanceError if a
+    guarded row changed in between; the caller should roll back.
+    """
+    withdrawals = {key: quantity for key, quantity in withdrawals.items() if quantity > 0}
+    if not withdrawals:
+        return {}
+
+    balances = stock_levels(withdrawals)
+
+    shortfalls = {}
+    for key, quantity in withdrawals.items():
+        available = balances.get(key, (0, None))[0]
+        if available < quantity:
+            shortfalls[key] = available
+    if shortfalls:
+        return shortfalls
+
+    table = StockBalance.__table__
+    stmt = update(table).where(
+        table.c.product_id == bindparam('p_id'),
+        table.c.warehouse_id == bindparam('w_id'),
+        table.c.version == bindparam('expected_version'),
+        table.c.quantity >= bindparam('amount')
+    ).values(
+        quantity=table.c.quantity - bindparam('amount'),
+        version=table.c.version + 1,
+        updated_at=datetime.utcnow()
+    )
+    result = db.session.execute(stmt, [
+        {'p_id': product_id, 'w_id': warehouse_id, 'amount': quantity,
+         'expected_version': balances[(product_id, warehouse_id)][1]}
+        for (product_id, warehouse_id), quantity in withdrawals.items()
+    ])
+    if result.rowcount != len(withdrawals):
+        raise StaleBalanceError('Stock levels changed during validation; please retry')
+    return {}
+
+
+def apply_balance_deltas(deltas):
+    if not deltas:
+        return
+
+    now = datetime.utcnow()
+    stmt = sqlite_insert(StockBalance)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StockBalance.product_id, StockBalance.warehouse_id],
+        set_={
+            'quantity': StockBalance.quantity + stmt.excluded.quantity,
+            'version': StockBalance.version + 1,
+            'updated_at': stmt.excluded.updated_at
+        }
+    )
+    db.session.execute(stmt, [
+        {'product_id': product_id, 'warehouse_id': warehouse_id, 'quantity': delta, 'updated_at': now}
+        for (product_id, warehouse_id), delta in deltas.items()
+    ])
+
+
+def stock_totals_query(warehouse_id=None):
+    """(product_id, stock) per product, summed over warehouses unless one is given."""
+    query = db.session.query(
+        StockBalance.product_id.label('product_id'),
+        func.sum(StockBalance.quantity).label('stock')
+    )
+    if warehouse_id:
+        query = query.filter(StockBalance.warehouse_id == warehouse_id)
+    return query.group_by(StockBalance.product_id)
+
+
+def stock_matrix(product_ids, warehouse_ids=None):
+    """{product_id: {warehouse_id: quantity}} from one GROUP BY product_id, warehouse_id."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+
+    query = db.session.query(
+        StockBalance.product_id,
+        StockBalance.warehouse_id,
+        func.sum(StockBalance.quantity)
+    ).filter(StockBalance.product_id.in_(product_ids))
+    if warehouse_ids is not None:
+        query = query.filter(StockBalance.warehouse_id.in_(list(warehouse_ids)))
+
+    rows = query.group_by(StockBalance.product_id, StockBalance.warehouse_id).all()
+
+    matrix = {product_id: {} for product_id in product_ids}
+    for product_id, warehouse_id, quantity in rows:
+        matrix[product_id][warehouse_id] = quantity
+    return matrix
+
+
+def warehouse_totals():
+    """{warehouse_id: (total quantity, number of products with stock)}."""
+    rows = db.session.query(
+        StockBalance.warehouse_id,
+        func.sum(StockBalance.quantity),
+        func.count(StockBalance.product_id).filter(StockBalance.quantity != 0)
+    ).group_by(StockBalance.warehouse_id)
+    return {warehouse_id: (quantity, products) for warehouse_id, quantity, products in rows}
+
+
+def rebuild_stock_balances():
+    """Recompute every balance from the opening balances and the live ledger. Returns the row count."""
+    db.session.query(StockBalance).delete()
+
+    ledger = union_all(
+        select(StockMovement.product_id, StockMovement.warehouse_id, StockMovement.quantity,
+               StockMovement.created_at),
+        select(OpeningBalance.product_id, OpeningBalance.warehouse_id, OpeningBalance.quantity,
+               null().label('created_at'))
+    ).subquery()
+    totals = select(
+        ledger.c.product_id,
+        ledger.c.warehouse_id,
+        func.sum(ledger.c.quantity),
+        func.coalesce(func.max(ledger.c.created_at), datetime.utcnow())
+    ).group_by(ledger.c.product_id, ledger.c.warehouse_id)
+
+    db.session.execute(insert(StockBalance).from_select(
+        ['product_id', 'warehouse_id', 'quantity', 'updated_at'], totals
+    ))
+    db.session.commit()
+
+    return StockBalance.query.count()
@@ -0,0 +1,54 @@
+"""Operations timeline, derived from the stock ledger.
+
+`operation_timeline` is an SQL view over stock_movements: one row per
+document line (transfers show their outgoing leg, described with both
+warehouse names from the transfer header). It replaces the old `operations`
+table, which duplicated every ledger row at validation time.
+"""
+from sqlalchemy import DateTime, Float, Integer, String, column, select, table
+from app import db
+
+TIMELINE_VIEW = """
+CREATE VIEW IF NOT EXISTS operation_timeline AS
+SELECT
+    m.id AS id,
+    CASE m.operation_type WHEN 'transfer_out' THEN 'transfer' ELSE m.operation_type END AS operation_type,
+    m.reference AS reference,
+    CASE m.operation_type
+        WHEN 'transfer_out' THEN 'Transfer: ' || src.name || ' → ' || coalesce(dest.name, '')
+        ELSE m.notes
+    END AS description,
+    abs(m.quantity) AS quantity,
+    p.name AS product_name,
+    m.created_at AS created_at,
+    m.created_by AS created_by
+FROM stock_movements m
+JOIN products p ON p.id = m.product_id
+LEFT JOIN warehouses src ON m.operation_type = 'transfer_out' AND src.id = m.warehouse_id
+LEFT JOIN transfers t ON m.operation_type = 'transfer_out' AND t.reference = m.reference
+LEFT JOIN warehouses dest ON dest.id = t.dest_warehouse_id
+WHERE m.operation_type IN ('receipt', 'delivery', 'transfer_out', 'adjustment')
+"""
+
+operation_timeline = table(
+    'operation_timeline',
+    column('id', Integer),
+    column('operation_type', String),
+    column('reference', String),
+    column('description', String),
+    column('quantity', Float),
+    column('product_name', String),
+    column('created_at', DateTime),
+    column('created_by', Integer)
+)
+
+
+def recent_operations_query(limit=10):
+    return select(operation_timeline).order_by(
+        operation_timeline.c.created_at.desc(), operation_timeline.c.id.desc()
+    ).limit(limit)
+
+
+def recent_operations(limit=10):
+    """Latest timeline entries as plain dicts, newest first."""
+    return [dict(row) for row in db.session.execute(recent_operations_query(limit)).mappings()]
@@ -0,0 +1,221 @@
+"""Document validation: turn draft documents' lines into ledger movements.
+
+Everything runs inside the caller's transaction and does not commit, so the
+write queue can validate several documents in one transaction. Lines,
+product names and balances are loaded with a fixed number of queries, and
+movement rows are built as plain dicts and written with an executemany
+insert, so cost grows with the row count rather than with ORM
+unit-of-work overhead. Deliveries and transfers take their stock with one
+guarded UPDATE (withdraw_stock), so two validations can never sell the same
+units.
+
+validate_chunk reports per document; the validate_<type> functions wrap it
+for a single document and raise ValidationError or NotFound instead.
+"""
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import update
+from werkzeug.exceptions import NotFound
+from app import db
+from app.models import (Receipt, ReceiptLine, Delivery, DeliveryLine, Transfer, TransferLine,
+                        Adjustment, AdjustmentLine, Product, Warehouse)
+from app.services.stock import record_movements, stock_levels, withdraw_stock, StaleBalanceError
+from app.services.writer import run_inline, WriteTimeout
+
+
+class ValidationError(Exception):
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details
+
+
+def movement_row(product_id, warehouse_id, quantity, operation_type, reference, notes, user_id, now,
+                 unit_cost=None):
+    return {
+        'product_id': product_id,
+        'warehouse_id': warehouse_id,
+        'quantity': quantity,
+        'operation_type': operation_type,
+        'reference': reference,
+        'notes': notes,
+        'created_at': now,
+        'created_by': user_id,
+        'unit_cost': unit_cost
+    }
+
+
+def receipt_rows(receipt, lines, warehouse_names, user_id, now):
+    notes = f'Receipt from {receipt.supplier_name}'
+    movements = [movement_row(line.product_id, receipt.warehouse_id, line.quantity, 'receipt',
+                              receipt.reference, notes, user_id, now, line.unit_price or None) for line in lines]
+    return movements, {}
+
+
+def delivery_rows(delivery, lines, warehouse_names, user_id, now):
+    notes = f'Delivery to {delivery.customer_name}'
+    movements = [movement_row(line.product_id, delivery.warehouse_id, -line.quantity, 'delivery',
+                              delivery.reference, notes, user_id, now) for line in lines]
+    withdrawals = defaultdict(float)
+    for line in lines:
+        withdrawals[(line.product_id, delivery.warehouse_id)] += line.quantity
+    return movements, withdrawals
+
+
+def transfer_rows(transfer, lines, warehouse_names, user_id, now):
+    source = warehouse_names[transfer.source_warehouse_id]
+    dest = warehouse_names[transfer.dest_warehouse_id]
+    movements = []
+    withdrawals = defaultdict(float)
+    for line in lines:
+        movements.append(movement_row(line.product_id, transfer.source_warehouse_id, -line.quantity,
+                                      'transfer_out', transfer.reference, f'Transfer to {dest}', user_id, now))
+        movements.append(movement_row(line.product_id, transfer.dest_warehouse_id, line.quantity,
+                                      'transfer_in', transfer.reference, f'Transfer from {source}', user_id, now))
+        withdrawals[(line.product_id, transfer.source_warehouse_id)] += line.quantity
+    return movements, withdrawals
+
+
+def adjustment_rows(adjustment, lines, warehouse_names, user_id, now):
+    notes = f'Adjustment: {adjustment.reason}'
+    movements = [movement_row(line.product_id, adjustment.warehouse_id, line.difference, 'adjustment',
+                              adjustment.reference, notes, user_id, now) for line in lines if line.difference != 0]
+    return movements, {}
+
+
+# kind -> (document model, line model, line's document key, label, row builder)
+DOCUMENT_TYPES = {
+    'receipts': (Receipt, ReceiptLine, ReceiptLine.receipt_id, 'Receipt', receipt_rows),
+    'deliveries': (Delivery, DeliveryLine, DeliveryLine.delivery_id, 'Delivery', delivery_rows),
+    'transfers': (Transfer, TransferLine, TransferLine.transfer_id, 'Transfer', transfer_rows),
+    'adjustments': (Adjustment, AdjustmentLine, AdjustmentLine.adjustment_id, 'Adjustment', adjustment_rows),
+}
+
+
+def validate_chunk(kind, document_ids, user_id):
+    """Validate drafts of one type inside the caller's transaction.
+
+    Documents are checked in the order given; a delivery or transfer that
+    would overdraw a balance (counting earlier documents in the chunk) fails
+    on its own without affecting the others. Returns {'results', 'product_ids'}
+    where results has one entry per id.
+    """
+    model, line_model, parent_key, label, build_rows = DOCUMENT_TYPES[kind]
+    documents = {document.id: document for document in model.query.filter(model.id.in_(document_ids))}
+    lines_by_document = defaultdict(list)
+    for line in line_model.query.filter(parent_key.in_(list(documents))).order_by(line_model.id):
+        lines_by_document[getattr(line, parent_key.key)].append(line)
+
+    product_ids = {line.product_id for lines in lines_by_document.values() for line in lines}
+    names = dict(db.session.query(Product.id, Product.name).filter(Product.id.in_(product_ids))) if product_ids else {}
+    warehouse_names = dict(db.session.query(Warehouse.id, Warehouse.name))
+    now = datetime.utcnow()
+
+    results, plans = [], []
+    for document_id in document_ids:
+        document = documents.get(document_id)
+        if document is None:
+            results.append({'id': document_id, 'success': False, 'error': f'{label} not found'})
+        elif document.status != 'draft':
+            results.append({'id': document_id, 'reference': document.reference, 'success': False,
+                            'error': f'{label} already validated'})
+        elif not lines_by_document.get(document_id):
+            results.append({'id': document_id, 'reference': document.reference, 'success': False,
+                            'error': f'Cannot validate {label.lower()} with no lines'})
+        else:
+            rows = build_rows(document, lines_by_document[document_id], warehouse_names, user_id, now)
+            result = {'id': document_id, 'reference': document.reference, 'success': True}
+            results.append(result)
+            plans.append((document, result, rows))
+
+    available = {key: quantity for key, (quantity, _) in
+                 stock_levels({key for _, _, (_, withdrawals) in plans for key in withdrawals}).items()}
+    movements, withdrawn, validated = [], defaultdict(float), []
+    for document, result, (document_movements, withdrawals) in plans:
+        short = [(key, quantity) for key, quantity in withdrawals.items() if available.get(key, 0) < quantity]
+        if short:
+            details = [{'product_id': product_id, 'product_name': names[product_id], 'requested': quantity,
+                        'available': available.get((product_id, warehouse_id), 0)}
+                       for (product_id, warehouse_id), quantity in short]
+            location = ' in source warehouse' if kind == 'transfers' else ''
+            result.update(success=False, lines=details, error=f'Insufficient stock{location} for ' + '; '.join(
+                f'{d["product_name"]} (available: {d["available"]}, requested: {d["requested"]})' for d in details
+            ))
+            continue
+        for key, quantity in withdrawals.items():
+            available[key] -= quantity
+            withdrawn[key] += quantity
+        movements.extend(document_movements)
+        validated.append(document.id)
+
+    if withdraw_stock(withdrawn):
+        raise StaleBalanceError('Stock levels changed during validation; please retry')
+    record_movements(movements, withdrawn)
+    if validated:
+        db.session.execute(update(model).where(model.id.in_(validated)).values(status='done', validated_at=now))
+    db.session.expire_all()
+
+    return {'results': results, 'product_ids': {row['product_id'] for row in movements}}
+
+
+def validate_document(kind, document_id, user_id):
+    """Validate one draft; raises NotFound or ValidationError instead of reporting."""
+    outcome = validate_chunk(kind, [document_id], user_id)
+    result = outcome['results'][0]
+    if not result['success']:
+        if 'reference' not in result:
+            raise NotFound()
+        raise ValidationError(result['error'], result.get('lines'))
+    return {'reference': result['reference'], 'product_ids': outcome['product_ids']}
+
+
+def validate_receipt(receipt_id, user_id):
+    return validate_document('receipts', receipt_id, user_id)
+
+
+def validate_delivery(delivery_id, user_id):
+    return validate_document('deliveries', delivery_id, user_id)
+
+
+def validate_transfer(transfer_id, user_id):
+    return validate_document('transfers', transfer_id, user_id)
+
+
+def validate_adjustment(adjustment_id, user_id):
+    return validate_document('adjustments', adjustment_id, user_id)
+
+
+def draft_ids(kind, start=None, end=None):
+    """Ids of the drafts of one type created in [start, end] (datetimes, either optional), oldest first."""
+    model = DOCUMENT_TYPES[kind][0]
+    query = db.session.query(model.id).filter(model.status == 'draft')
+    if start:
+        query = query.filter(model.created_at >= start)
+    if end:
+        query = query.filter(model.created_at < end)
+    return [document_id for document_id, in query.order_by(model.created_at, model.id)]
+
+
+def validate_documents(kind, document_ids, user_id, chunk_size=200, submit=None):
+    """Validate documents in chunks of `chunk_size`, each committed by `submit`.
+
+    `submit(fn, *args)` runs one chunk in a write transaction (the write
+    queue's submit; run_inline by default). Returns {'results', 'product_ids',
+    'timed_out'}; after a WriteTimeout the remaining documents are reported as
+    not validated and left for a retry.
+    """
+    submit = submit or run_inline
+    results, product_ids = [], set()
+    for start in range(0, len(document_ids), chunk_size):
+        chunk_ids = document_ids[start:start + chunk_size]
+        try:
+            chunk = submit(validate_chunk, kind, chunk_ids, user_id)
+        except StaleBalanceError as e:
+            chunk = {'results': [{'id': document_id, 'success': False, 'error': str(e)} for document_id in chunk_ids],
+                     'product_ids': set()}
+        except WriteTimeout as e:
+            results.extend({'id': document_id, 'success': False, 'error': str(e)}
+                           for document_id in document_ids[start:])
+            return {'results': results, 'product_ids': product_ids, 'timed_out': True}
+        results.extend(chunk['results'])
+        product_ids |= chunk['product_ids']
+    return {'results': results, 'product_ids': product_ids, 'timed_out': False}
@@ -0,0 +1,153 @@
+"""Inventory valuation at weighted-average cost, kept current per movement.
+
+stock_valuations holds the quantity and weighted-average unit cost of every
+(product, warehouse). value_movements runs on new ledger rows before they are
+written (record_movements, the catalog import) and walks them in order:
+
+- receipts bring stock in at the line's unit price, and a transfer's incoming
+  row at the cost its outgoing row left the source with; both re-average the
+  receiving warehouse's cost;
+- everything else (deliveries, outgoing transfers, adjustments, opening
+  balances, receipts without a price) moves stock at the current cost.
+
+Each row's unit_cost is stored on the ledger, so the cost of goods moved
+stays on record, and value reports are one aggregate over stock_valuations
+instead of a replay of the ledger. rebuild_valuations does that replay once,
+to fill the table for an existing database.
+"""
+from datetime import datetime
+from sqlalchemy import func, insert, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import db
+from app.models import StockValuation, Receipt, ReceiptLine, Product, Warehouse, Category
+from app.services.ledger_export import iter_ledger, ledger_sources
+
+STOCK_VALUE = func.sum(StockValuation.quantity * func.coalesce(StockValuation.unit_cost, 0))
+UNCOSTED_QUANTITY = func.sum(StockValuation.quantity).filter(StockValuation.unit_cost.is_(None))
+
+
+def valuation_state(keys):
+    """{(product_id, warehouse_id): [quantity, unit_cost]} for `keys`; keys without a row start empty."""
+    keys = list(keys)
+    state = {key: [0.0, None] for key in keys}
+    if keys:
+        for product_id, warehouse_id, quantity, unit_cost in db.session.query(
+            StockValuation.product_id, StockValuation.warehouse_id, StockValuation.quantity, StockValuation.unit_cost
+        ).filter(tuple_(StockValuation.product_id, StockValuation.warehouse_id).in_(keys)):
+            state[(product_id, warehouse_id)] = [quantity, unit_cost]
+    return state
+
+
+def apply_costs(rows, state, in_transit=None):
+    """Walk ledger rows in order, updating `state` and setting each row's unit_cost.
+
+    `in_transit` carries outgoing transfer costs to their incoming rows across calls.
+    """
+    in_transit = {} if in_transit is None else in_transit
+    for row in rows:
+        held = state.setdefault((row['product_id'], row['warehouse_id']), [0.0, None])
+        quantity, cost = row['quantity'], row.get('unit_cost')
+        if row['operation_type'] == 'transfer_in':
+            cost = in_transit.pop((row['reference'], row['product_id']), cost)
+
+        if quantity > 0 and cost is not None:
+            if held[1] is None or held[0] <= 0:
+                held[1] = cost
+            else:
+                held[1] = (held[0] * held[1] + quantity * cost) / (held[0] + quantity)
+        else:
+            cost = held[1]
+        row['unit_cost'] = cost
+        held[0] += quantity
+
+        if row['operation_type'] == 'transfer_out':
+            in_transit[(row['reference'], row['product_id'])] = cost
+
+
+def write_state(state):
+    if not state:
+        return
+    now = datetime.utcnow()
+    stmt = sqlite_insert(StockValuation)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StockValuation.product_id, StockValuation.warehouse_id],
+        set_={'quantity': stmt.excluded.quantity, 'unit_cost': stmt.excluded.unit_cost,
+              'updated_at': stmt.excluded.updated_at}
+    )
+    db.session.execute(stmt, [
+        {'product_id': product_id, 'warehouse_id': warehouse_id, 'quantity': quantity,
+         'unit_cost': unit_cost, 'updated_at': now}
+        for (product_id, warehouse_id), (quantity, unit_cost) in state.items()
+    ])
+
+
+def value_movements(rows):
+    """Cost new ledger rows (plain dicts, in order) and apply them to stock_valuations.
+
+    Sets every row's unit_cost; runs inside the caller's transaction.
+    """
+    if not rows:
+        return
+    state = valuation_state({(row['product_id'], row['warehouse_id']) for row in rows})
+    apply_costs(rows, state)
+    write_state(state)
+
+
+def receipt_prices():
+    """{(reference, product_id): average unit price} of validated receipts with a price."""
+    rows = db.session.query(
+        Receipt.reference, ReceiptLine.product_id,
+        func.sum(ReceiptLine.quantity * ReceiptLine.unit_price) / func.sum(ReceiptLine.quantity)
+    ).join(Receipt, Receipt.id == ReceiptLine.receipt_id).filter(
+        Receipt.status == 'done', ReceiptLine.unit_price > 0
+    ).group_by(Receipt.reference, ReceiptLine.product_id)
+    return {(reference, product_id): price for reference, product_id, price in rows}
+
+
+def rebuild_valuations(chunk_size=5000):
+    """Replay the whole ledger, archive included, into stock_valuations. Returns the row count.
+
+    Receipts recorded before movements carried a unit_cost are priced from
+    their receipt lines.
+    """
+    prices = receipt_prices()
+    state, in_transit = {}, {}
+    for row in iter_ledger(ledger_sources(), chunk_size):
+        row = dict(row)
+        if row['unit_cost'] is None and row['operation_type'] == 'receipt':
+            row['unit_cost'] = prices.get((row['reference'], row['product_id']))
+        apply_costs([row], state, in_transit)
+
+    db.session.query(StockValuation).delete()
+    if state:
+        now = datetime.utcnow()
+        db.session.execute(insert(StockValuation.__table__), [
+            {'product_id': product_id, 'warehouse_id': warehouse_id, 'quantity': quantity,
+             'unit_cost': unit_cost, 'updated_at': now}
+            for (product_id, warehouse_id), (quantity, unit_cost) in state.items()
+        ])
+    db.session.commit()
+    return len(state)
+
+
+def value_by_warehouse():
+    """[{'warehouse_id', 'name', 'quantity', 'value', 'uncosted_quantity'}], by warehouse name."""
+    rows = db.session.query(
+        Warehouse.id, Warehouse.name, func.sum(StockValuation.quantity), STOCK_VALUE, UNCOSTED_QUANTITY
+    ).join(StockValuation, StockValuation.warehouse_id == Warehouse.id).group_by(Warehouse.id).order_by(Warehouse.name)
+    return [{'warehouse_id': warehouse_id, 'name': name, 'quantity': quantity, 'value': value,
+             'uncosted_quantity': uncosted or 0}
+            for warehouse_id, name, quantity, value, uncosted in rows]
+
+
+def value_by_category(warehouse_id=None):
+    """[{'category_id', 'name', 'quantity', 'value', 'uncosted_quantity'}], optionally for one warehouse."""
+    query = db.session.query(
+        Product.category_id, Category.name, func.sum(StockValuation.quantity), STOCK_VALUE, UNCOSTED_QUANTITY
+    ).join(Product, Product.id == StockValuation.product_id).outerjoin(Category, Category.id == Product.category_id)
+    if warehouse_id:
+        query = query.filter(StockValuation.warehouse_id == warehouse_id)
+    rows = query.group_by(Product.category_id).order_by(Category.name)
+    return [{'category_id': category_id, 'name': name or 'Uncategorized', 'quantity': quantity, 'value': value,
+             'uncosted_quantity': uncosted or 0}
+            for category_id, name, quantity, value, uncosted in rows]
@@ -0,0 +1,152 @@
+"""Single-writer queue with group commit for ledger writes.
+
+SQLite allows one writer at a time. Instead of every request thread racing
+for the write lock (and sleeping in busy_timeout), request handlers submit a
+job and wait for its result while one writer thread runs the jobs. The
+writer takes whatever jobs are queued (up to WRITE_QUEUE_BATCH_SIZE, waiting
+at most WRITE_QUEUE_BATCH_WAIT seconds for more) and runs them in a single
+BEGIN IMMEDIATE transaction, each inside its own savepoint, so one job's
+failure rolls back only that job. The batch is committed once.
+
+A job still queued after WRITE_QUEUE_TIMEOUT is cancelled and its caller
+gets WriteTimeout: nothing was written, so the request can be retried. A job
+the writer has already started is waited for, since it may commit.
+
+With WRITE_QUEUE_ENABLED off (or outside a request-serving process) jobs run
+inline in the caller's session and commit on their own.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from app import db
+
+
+class WriteTimeout(Exception):
+    """A queued job waited too long and was withdrawn before it ran."""
+
+
+class WriteQueue:
+    def __init__(self):
+        self.enabled = False
+        self.batch_size = 32
+        self.batch_wait = 0.005
+        self.timeout = 30
+        self.app = None
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.committed = 0
+        self.failed = 0
+
+    def configure(self, app):
+        self.app = app
+        self.enabled = app.config['WRITE_QUEUE_ENABLED']
+        self.batch_size = app.config['WRITE_QUEUE_BATCH_SIZE']
+        self.batch_wait = app.config['WRITE_QUEUE_BATCH_WAIT']
+        self.timeout = app.config['WRITE_QUEUE_TIMEOUT']
+
+    def submit(self, fn, *args):
+        """Run `fn(*args)` in a write transaction and return its result (or raise its exception)."""
+        if not self.enabled:
+            return run_inline(fn, *args)
+
+        self.start()
+        # Hand the request's pooled connection back while waiting, so queued
+        # requests cannot starve the writer of connections.
+        db.session.close()
+        future = Future()
+        self.jobs.put((future, fn, args))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise WriteTimeout('The database is busy; try again shortly')
+            return future.result()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='ledger-writer', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.jobs.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.jobs.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            with self.app.app_context():
+                self.run_batch(batch)
+
+    def run_batch(self, batch):
+        # Skip jobs their callers gave up on while they were queued.
+        batch = [job for job in batch if job[0].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        results = []
+        try:
+            begin_immediate()
+            for future, fn, args in batch:
+                try:
+                    with db.session.begin_nested():
+                        results.append((future, fn(*args), None))
+                except Exception as e:
+                    results.append((future, None, e))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self.batches += 1
+            self.failed += len(batch)
+            for future, _, _ in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        for future, result, error in results:
+            if error is None:
+                self.committed += 1
+                future.set_result(result)
+            else:
+                self.failed += 1
+                future.set_exception(error)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'queued': self.jobs.qsize(),
+            'batches': self.batches,
+            'committed': self.committed,
+            'failed': self.failed,
+            'avg_batch_size': round((self.committed + self.failed) / self.batches, 2) if self.batches else None
+        }
+
+
+def begin_immediate():
+    """Take SQLite's write lock now, so reads made by the job see the data it commits against."""
+    connection = db.session.connection()
+    if not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def run_inline(fn, *args):
+    try:
+        begin_immediate()
+        result = fn(*args)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return result
+
+
+write_queue = WriteQueue()
+
+
+def init_app(app):
+    write_queue.configure(app)
@@ -0,0 +1,38 @@
+"""SQLite connection profile: pragmas applied to every pooled connection.
+
+Pragmas such as synchronous, cache_size and busy_timeout are per connection,
+so they are set from a `connect` event rather than once at startup.
+journal_mode=WAL is stored in the database file but is re-asserted here so a
+copied or restored database picks it up again.
+"""
+from sqlalchemy import event
+
+REPORTED_PRAGMAS = ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size',
+                    'mmap_size', 'temp_store', 'foreign_keys')
+SYNCHRONOUS_NAMES = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+TEMP_STORE_NAMES = {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'}
+
+
+def init_app(app, engine):
+    pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+        finally:
+            cursor.close()
+
+
+def active_pragmas(connection):
+    """Current values of the profile's pragmas on `connection`, with names for enum pragmas."""
+    values = {}
+    for name in REPORTED_PRAGMAS:
+        values[name] = connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+    values['synchronous'] = SYNCHRONOUS_NAMES.get(values['synchronous'], values['synchronous'])
+    values['temp_store'] = TEMP_STORE_NAMES.get(values['temp_store'], values['temp_store'])
+    return values
@@ -12,14 +12,69 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
     # SQLite-specific settings for better concurrency
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20))
     SQLALCHEMY_ENGINE_OPTIONS = {
         'connect_args': {
             'check_same_thread': False,  # Allow multi-threaded access
-            'timeout': 20  # Timeout for database locks
-        }
+            'timeout': SQLITE_BUSY_TIMEOUT  # Timeout for database locks
+        },
+        'pool_size': int(os.environ.get('SQLITE_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('SQLITE_POOL_OVERFLOW', 10)),
+        'pool_timeout': 30
     }
     
+    # Applied to every new connection (see app/sqlite_profile.py). WAL lets
+    # readers run while a writer commits; NORMAL sync is durable in WAL mode
+    # except across a power loss. cache_size is in KiB when negative.
+    SQLITE_PRAGMAS = {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': SQLITE_BUSY_TIMEOUT * 1000,
+        'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -65536)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 268435456)),
+        'temp_store': 'MEMORY'
+    }
+    
+    # Document validations go through one writer thread per process, which
+    # commits up to BATCH_SIZE queued validations in a single transaction.
+    WRITE_QUEUE_ENABLED = os.environ.get('WRITE_QUEUE_ENABLED', '1') == '1'
+    WRITE_QUEUE_BATCH_SIZE = 32
+    WRITE_QUEUE_BATCH_WAIT = 0.005  # seconds to wait for more jobs before committing
+    WRITE_QUEUE_TIMEOUT = 30  # seconds a request waits for its result
+    BATCH_VALIDATE_CHUNK_SIZE = 200  # documents per transaction in batch validation
+    
+    # `flask checkpoint-ledger` moves movements older than this many days to
+    # stock_movements_archive, folding them into opening balances.
+    LEDGER_RETENTION_DAYS = int(os.environ.get('LEDGER_RETENTION_DAYS', 365))
+    LEDGER_CHECKPOINT_CHUNK_SIZE = 5000  # movements per transaction
+    STOCK_ROLLUP_CHUNK_DAYS = 31  # days per transaction in `flask roll-up-stock`
+    
     ITEMS_PER_PAGE = 20
     LOW_STOCK_DAYS_THRESHOLD = 7
     
+    # Demand forecasts (app/services/forecast.py), rebuilt only by
+    # `flask forecast-demand`; schedule it (e.g. nightly). Forecasts older
+    # than MAX_AGE are ignored in favour of the live moving average.
+    FORECAST_HISTORY_WEEKS = 8
+    FORECAST_MOVING_AVERAGE_DAYS = 30
+    FORECAST_SMOOTHING = 0.2  # weight of the latest day in exponential smoothing
+    FORECAST_MAX_AGE_HOURS = int(os.environ.get('FORECAST_MAX_AGE_HOURS', 36))
+    
+    # ABC / turnover analytics (app/services/analytics.py). The window reads
+    # only stock_movements, so keep it within the ledger retention.
+    ANALYTICS_WINDOW_DAYS = 90
+    ANALYTICS_ABC_SPLIT = (0.8, 0.95)  # cumulative consumption value closing classes A and B
+    ANALYTICS_CHUNK_SIZE = 100000  # movement ids per query
+    
+    # Shared dashboard KPI cache; entries are also dropped whenever operations
+    # are created/validated or a product's stock thresholds change.
+    KPI_CACHE_TTL = int(os.environ.get('KPI_CACHE_TTL', 60))
+    KPI_CACHE_MAX_ENTRIES = 128
+    
+    # Per-process barcode scanner cache. Entries are dropped when a product is
+    # edited or its stock moves; the TTL bounds staleness from writes made by
+    # other processes (CLI imports, other workers).
+    BARCODE_CACHE_TTL = int(os.environ.get('BARCODE_CACHE_TTL', 300))
+    BARCODE_CACHE_MAX_ENTRIES = 4096
+    
     REPLIT_AUTH_ENABLED = True
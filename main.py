@@ -1,5 +1,22 @@
 from app import create_app, db
 from app.models import User, Product, Category, Warehouse
+from app.services.stock import rebuild_stock_balances as rebuild_balances
+from app.services.query_plans import check_query_plans as run_plan_checks
+from app.services.catalog_import import import_catalog, detect_format
+from app.services.ledger_export import export_ledger as stream_ledger, EXPORT_FORMATS
+from app.services.validation import DOCUMENT_TYPES, draft_ids, validate_documents
+from app.services.ledger_archive import checkpoint_ledger as run_checkpoint, retention_cutoff
+from app.services.forecast import refresh_forecasts
+from app.services.snapshots import roll_up_stock as run_rollup
+from app.services.valuation import rebuild_valuations as rebuild_valuation_table
+from app.services.replenishment import plan_replenishment as run_planner, apply_plan, purchase_csv
+from app.services.writer import run_inline
+from app.services.cache import invalidate_kpis
+from app.migrations import run_migrations, get_schema_version
+import click
+import sys
+import time
+from datetime import timedelta
 
 app = create_app()
 
@@ -34,5 +51,167 @@ def init_db():
         db.session.commit()
         print('Default categories created.')
 
+@app.cli.command()
+def rebuild_stock_balances():
+    count = rebuild_balances()
+    print(f'Rebuilt {count} stock balance rows from the ledger.')
+
+@app.cli.command()
+@click.option('--chunk-size', default=5000, show_default=True, help='Ledger rows read per query.')
+def rebuild_valuations(chunk_size):
+    count = rebuild_valuation_table(chunk_size)
+    print(f'Rebuilt {count} stock valuation rows from the ledger.')
+
+@app.cli.command()
+def migrate_db():
+    for version, description in run_migrations(db.engine):
+        print(f'Applied migration {version}: {description}')
+    print(f'Schema version: {get_schema_version(db.engine)}')
+
+@app.cli.command()
+def check_query_plans():
+    failures = 0
+    for name, plan, problems in run_plan_checks():
+        print(f'{"FAIL" if problems else "ok":4}  {name}')
+        for line in plan:
+            print(f'        {line}')
+        failures += bool(problems)
+    
+    if failures:
+        print(f'{failures} hot queries regressed to a full scan or temp sort.')
+        sys.exit(1)
+    print('All hot queries use indexes.')
+
+@app.cli.command()
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--warehouse', help='Warehouse name for opening stock (default: first active warehouse).')
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--errors', 'errors_path', help='Error report path (default: <path>.errors.csv).')
+def import_products(path, fmt, warehouse, batch_size, errors_path):
+    query = Warehouse.query.filter_by(is_active=True)
+    if warehouse:
+        query = Warehouse.query.filter_by(name=warehouse)
+    default_warehouse = query.order_by(Warehouse.id).first()
+    if warehouse and default_warehouse is None:
+        raise click.BadParameter(f'Unknown warehouse {warehouse}', param_hint='--warehouse')
+    
+    def progress(stats):
+        print(f'  {stats["rows"]} rows read, {stats["created"]} created, '
+              f'{stats["updated"]} updated, {stats["errors"]} errors', flush=True)
+    
+    errors_path = errors_path or f'{path}.errors.csv'
+    with open(path, 'rb') as stream, open(errors_path, 'w', newline='') as error_stream:
+        stats = import_catalog(
+            stream, fmt or detect_format(path), error_stream=error_stream,
+            warehouse_id=default_warehouse.id if default_warehouse else None,
+            batch_size=batch_size, progress=progress
+        )
+    invalidate_kpis()
+    
+    print(f'Imported {stats["rows"]} rows in {stats["seconds"]}s: {stats["created"]} products created, '
+          f'{stats["updated"]} updated, {stats["categories_created"]} categories created, '
+          f'{stats["movements"]} opening balance movements.')
+    if stats['errors']:
+        print(f'{stats["errors"]} rows rejected; see {errors_path}')
+
+@app.cli.command()
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Defaults to stdout.')
+@click.option('--start', help='First day to include (YYYY-MM-DD).')
+@click.option('--end', help='Last day to include (YYYY-MM-DD).')
+@click.option('--warehouse-id', type=int)
+@click.option('--product-id', type=int)
+@click.option('--operation-type')
+@click.option('--chunk-size', default=5000, show_default=True)
+def export_ledger(fmt, output, start, end, warehouse_id, product_id, operation_type, chunk_size):
+    try:
+        chunks, _ = stream_ledger(fmt, chunk_size=chunk_size, start=start, end=end, warehouse_id=warehouse_id,
+                                  product_id=product_id, operation_type=operation_type)
+    except ValueError:
+        raise click.BadParameter('Dates must be in YYYY-MM-DD format', param_hint='--start/--end')
+    with click.open_file(output or '-', 'w') as out:
+        for chunk in chunks:
+            out.write(chunk)
+
+@app.cli.command()
+@click.argument('kind', type=click.Choice(list(DOCUMENT_TYPES)))
+@click.option('--ids', help='Comma-separated document ids; defaults to every draft in the date range.')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), help='First creation day to include (YYYY-MM-DD).')
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), help='Last creation day to include (YYYY-MM-DD).')
+@click.option('--chunk-size', type=int, help='Documents per transaction (default: BATCH_VALIDATE_CHUNK_SIZE).')
+@click.option('--user-id', type=int, help='Recorded as the validating user.')
+def batch_validate(kind, ids, start, end, chunk_size, user_id):
+    if ids:
+        document_ids = list(dict.fromkeys(int(i) for i in ids.split(',') if i.strip()))
+    else:
+        document_ids = draft_ids(kind, start, end + timedelta(days=1) if end else None)
+    if not document_ids:
+        print(f'No {kind} to validate.')
+        return
+    
+    report = validate_documents(kind, document_ids, user_id,
+                                chunk_size or app.config['BATCH_VALIDATE_CHUNK_SIZE'])
+    invalidate_kpis()
+    
+    failed = [result for result in report['results'] if not result['success']]
+    for result in failed:
+        print(f'{result.get("reference") or result["id"]}: {result["error"]}')
+    print(f'Validated {len(document_ids) - len(failed)} of {len(document_ids)} {kind}.')
+    if failed:
+        sys.exit(1)
+
+@app.cli.command()
+@click.option('--before', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Archive movements before this day (YYYY-MM-DD); default: LEDGER_RETENTION_DAYS ago.')
+@click.option('--chunk-size', type=int, help='Movements per transaction (default: LEDGER_CHECKPOINT_CHUNK_SIZE).')
+def checkpoint_ledger(before, chunk_size):
+    cutoff = before or retention_cutoff(app.config['LEDGER_RETENTION_DAYS'])
+    try:
+        archived = run_checkpoint(cutoff, chunk_size or app.config['LEDGER_CHECKPOINT_CHUNK_SIZE'])
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print(f'Archived {archived} movements before {cutoff:%Y-%m-%d}.')
+
+@app.cli.command()
+def forecast_demand():
+    started = time.perf_counter()
+    count = run_inline(refresh_forecasts)
+    invalidate_kpis()
+    print(f'Forecast demand for {count} products in {time.perf_counter() - started:.2f}s.')
+
+@app.cli.command()
+@click.option('--chunk-days', type=int, help='Days per transaction (default: STOCK_ROLLUP_CHUNK_DAYS).')
+def roll_up_stock(chunk_days):
+    days = run_rollup(chunk_days=chunk_days or app.config['STOCK_ROLLUP_CHUNK_DAYS'])
+    print(f'Rolled up {days} days of stock movements.')
+
+@app.cli.command()
+@click.option('--apply', is_flag=True, help='Create the proposed transfers as drafts.')
+@click.option('--purchases', 'purchases_path', type=click.Path(dir_okay=False),
+              help='Write the purchase list to this CSV file.')
+@click.option('--receiving-warehouse-id', type=int,
+              help='Where purchases without demand history go (default: first active warehouse).')
+@click.option('--user-id', type=int, help='Recorded as the creator of the draft transfers.')
+def plan_replenishment(apply, purchases_path, receiving_warehouse_id, user_id):
+    started = time.perf_counter()
+    if apply:
+        plan = run_inline(apply_plan, receiving_warehouse_id, user_id)
+        invalidate_kpis()
+        lines = sum(transfer['lines'] for transfer in plan['transfers'])
+        verb = 'Created'
+    else:
+        plan = run_planner(receiving_warehouse_id)
+        lines = sum(len(transfer['lines']) for transfer in plan['transfers'])
+        verb = 'Planned'
+    print(f'{verb} {len(plan["transfers"])} transfers ({lines} lines); {len(plan["purchases"])} purchases to order '
+          f'({time.perf_counter() - started:.2f}s).')
+    
+    if purchases_path:
+        with open(purchases_path, 'w', newline='') as out:
+            out.write(purchase_csv(plan['purchases']))
+        print(f'Wrote the purchase list to {purchases_path}.')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)